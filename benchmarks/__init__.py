@@ -0,0 +1,5 @@
+"""
+Benchmarks for syncing and scheduling over synthetic notes and todolists.
+
+Run `python -m benchmarks.run` from the repository root.
+"""
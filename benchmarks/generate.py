@@ -0,0 +1,97 @@
+"""
+Generators for synthetic notes trees and todolists.
+"""
+import os
+import random
+from datetime import datetime, timedelta
+
+WORDS = ['read', 'paper', 'write', 'draft', 'email', 'review', 'proof', 'lemma',
+         'fix', 'bug', 'meeting', 'slides', 'lecture', 'notes', 'experiment',
+         'dataset', 'plot', 'results', 'reply', 'advisor', 'grant', 'budget',
+         'refactor', 'parser', 'deploy', 'server', 'benchmark', 'theorem']
+DURATIONS = ['5 m', '10 m', '15 m', '20 m', '30 m', '45 m', '1 h', '1 h 30 m', '2 h']
+
+def todo_text(rng):
+    """
+    a random todo, with a duration.
+    """
+    return '{}, {}'.format(' '.join(rng.choice(WORDS) for _ in range(rng.randint(2, 6))),
+            rng.choice(DURATIONS))
+
+def filler_line(rng):
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(4, 16)))
+
+def format_hex(value, hex_bits=8):
+    return '0x' + '%0{}X'.format(hex_bits) % value
+
+def note_paths(root, files=100, dirs=5, depth=3, seed=0):
+    """
+    the paths of the `files` notes of generate_notes_tree, spread over `dirs`
+    top level directories of root nested up to `depth` levels.
+    """
+    rng = random.Random(seed)
+    paths = []
+    for i in range(files):
+        d = os.path.join(root, 'notes%d' % (i % dirs))
+        for level in range(rng.randint(0, depth)):
+            d = os.path.join(d, 'sub%d' % rng.randint(0, 3))
+        paths.append(os.path.join(d, 'note%d.md' % i))
+    return paths
+
+def generate_notes_tree(root, files=100, file_size=4096, todo_density=0.1,
+        checked_ratio=0.3, dirs=5, depth=3, seed=0):
+    """
+    writes `files` notes of about file_size bytes each under root, at the
+    paths of note_paths. Each line is a todo with probability todo_density,
+    and each todo is checked with probability checked_ratio. Returns the list
+    of top level directories and the number of unchecked todos written.
+    """
+    rng = random.Random(seed)
+    top_dirs = [os.path.join(root, 'notes%d' % i) for i in range(dirs)]
+    unchecked = 0
+    for i, path in enumerate(note_paths(root, files, dirs, depth, seed)):
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        lines = ['# note %d' % i]
+        size = len(lines[0])
+        while size < file_size:
+            if rng.random() < todo_density:
+                checked = rng.random() < checked_ratio
+                unchecked += not checked
+                line = '* [{}] {}'.format('x' if checked else ' ', todo_text(rng))
+            else:
+                line = filler_line(rng)
+            lines.append(line)
+            size += len(line) + 1
+        with open(path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+    return top_dirs, unchecked
+
+def generate_todolist(fpath, todos=1000, date_sections=100, checked_ratio=0.3,
+        hex_start=0, seed=0, notes=None):
+    """
+    writes a todolist of `todos` tagged todos spread over `date_sections` date
+    sections, one day apart and newest first, each checked with probability
+    checked_ratio. The todos come from the notes at the paths in notes, in
+    order, like a sync of them would add them (by default, the notes of
+    note_paths with 20 todos each). Returns the next free hex id.
+    """
+    rng = random.Random(seed)
+    today = datetime.now().date()
+    date_sections = max(1, min(date_sections, todos))
+    notes = note_paths('', max(1, todos // 20), seed=seed) if notes is None else notes
+    lines = ['#TODO']
+    hex_id = hex_start
+    for section in range(date_sections):
+        date = today - timedelta(days=section)
+        lines.append('%d/%d/%s' % (date.month, date.day, str(date.year)[-2:]))
+        for _ in range(todos // date_sections + (section < todos % date_sections)):
+            checked = rng.random() < checked_ratio
+            note = notes[(hex_id - hex_start) * len(notes) // todos]
+            lines.append('* [{}] {} {{{}}} (in `{}`)'.format('x' if checked else ' ',
+                    todo_text(rng), format_hex(hex_id), note))
+            hex_id += 1
+        lines.append('')
+    with open(fpath, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    return hex_id
@@ -0,0 +1,194 @@
+"""
+Timing harness for the sync phases of todolist.py, and for the lookups and
+scheduling of todofetcher.py, over synthetic data at several scales.
+
+    python -m benchmarks.run --scales 100,1000,10000 --out bench.json
+
+Each scale is a number of todos. Results are written as JSON so that runs can
+be compared.
+"""
+import os
+import sys
+import io
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import contextlib
+from datetime import datetime
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+import config
+import utils
+from benchmarks.generate import note_paths, generate_notes_tree, generate_todolist
+
+def timed(fn, repeat=1):
+    """
+    calls fn repeat times with its output silenced, and returns the list of
+    wall times in seconds.
+    """
+    times = []
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            tic = time.perf_counter()
+            fn()
+            times.append(time.perf_counter() - tic)
+    return times
+
+@contextlib.contextmanager
+def sandbox(notes_dirs, todolist):
+    """
+    points config at the synthetic notes and todolist, and restores it after.
+    """
+    saved = (config.NOTES_DIRS, config.TODOLIST_NAME, config.HEX_START)
+    config.NOTES_DIRS = notes_dirs
+    config.TODOLIST_NAME = todolist
+    try:
+        yield
+    finally:
+        config.NOTES_DIRS, config.TODOLIST_NAME, config.HEX_START = saved
+
+def check_off_fraction(fpath, fraction):
+    """
+    checks off a fraction of the unchecked todos of the todolist, like a user
+    would in their editor.
+    """
+    with open(fpath) as f:
+        lines = f.readlines()
+    step = max(1, int(1 / fraction))
+    unchecked = [idx for idx, line in enumerate(lines) if utils.classify_line(line)[1] is False]
+    for idx in unchecked[::step]:
+        lines[idx] = utils.check_off_line(lines[idx])
+    with open(fpath, 'w') as f:
+        f.writelines(lines)
+
+def bench_sync(workdir, todos, args):
+    """
+    times a first sync of a notes tree holding `todos` new todos, a sync where
+    nothing changed, and a sync after checking off 1% of the todolist.
+    """
+    from store import IndexStore
+    from todolist import sync
+
+    per_note = args.todos_per_note
+    files = max(1, todos // per_note)
+    # about 60 bytes per line, and todo_density of the lines are todos
+    file_size = int(per_note / args.todo_density * 60)
+    dirs, _ = generate_notes_tree(os.path.join(workdir, 'notes'), files=files, file_size=file_size,
+            todo_density=args.todo_density, checked_ratio=args.checked_ratio, seed=args.seed)
+    todolist = os.path.join(workdir, 'todo.md')
+    with open(todolist, 'w') as f:
+        f.write('#TODO\n')
+
+    results = {}
+    with sandbox(dirs, todolist):
+        store = IndexStore(os.path.join(workdir, '.data'))
+        config.HEX_START = store.get_hex_start()
+        path2modtime, path2fingerprint = {}, {}
+        results['sync_first'] = timed(lambda: sync(store, path2modtime, path2fingerprint))
+        results['sync_noop'] = timed(lambda: sync(store, path2modtime, path2fingerprint), args.repeat)
+        check_off_fraction(todolist, 0.01)
+        results['sync_checkoff'] = timed(lambda: sync(store, path2modtime, path2fingerprint))
+        store.close()
+    return results
+
+def bench_queries(workdir, todos, args):
+    """
+    times reading the unchecked todos, scheduling them, and the -s/-k lookups
+    over a todolist of `todos` todos.
+    """
+    from store import IndexStore
+    from textindex import TextIndex
+    from snapshot import load_snapshot, write_snapshot
+    from todofetcher import get_priorities, get_feasible_set, todos_from_rows
+    try:
+        import columnar
+    except ImportError:
+        columnar = None
+
+    # the todos of the notes tree of bench_sync
+    notes = note_paths(os.path.join(workdir, 'notes'), files=max(1, todos // args.todos_per_note),
+            seed=args.seed)
+    todolist = os.path.join(workdir, 'todo.md')
+    generate_todolist(todolist, todos=todos, date_sections=max(1, todos // args.todos_per_section),
+            checked_ratio=args.checked_ratio, seed=args.seed, notes=notes)
+    # todos no older than the priority threshold, so that none of them are
+    # picked by the threshold alone and the schedulers get all of them
+    recent_todolist = os.path.join(workdir, 'recent.md')
+    generate_todolist(recent_todolist, todos=todos, date_sections=config.PRIORITY_THRESHOLD + 1,
+            checked_ratio=args.checked_ratio, seed=args.seed, notes=notes)
+
+    results = {}
+    with sandbox([], todolist):
+        results['unchecked_by_date'] = timed(utils.unchecked_by_date, args.repeat)
+        data_dir = os.path.join(workdir, '.data')
+        write_snapshot(utils.iter_todolist(todolist), data_dir=data_dir)
+        results['load_snapshot'] = timed(lambda: load_snapshot(data_dir=data_dir), args.repeat)
+
+        write_snapshot(utils.iter_todolist(recent_todolist), recent_todolist, data_dir)
+        todos = get_priorities(todos_from_rows(load_snapshot(recent_todolist, data_dir)))
+        budget = 150
+        for mode in ['knapsack', 'heap']:
+            results['get_feasible_set_' + mode] = timed(
+                    lambda: get_feasible_set(todos, budget, mode), args.repeat)
+        results['get_priorities'] = timed(lambda: get_priorities(todos), args.repeat)
+        if columnar is not None:
+            for decay in ['linear', 'exponential']:
+                results['columnar_schedule_' + decay] = timed(
+                        lambda: columnar.schedule(todos, budget, 'knapsack', decay), args.repeat)
+
+        store = IndexStore(data_dir)
+        text_index = TextIndex(store, todolist)
+        def build():
+            with store.transaction():
+                text_index.update(utils.unchecked_records())
+        results['text_index_build'] = timed(build)
+        results['search_substring'] = timed(lambda: text_index.search_substring('paper'), args.repeat)
+        results['search_keywords'] = timed(lambda: text_index.search_keywords(['review', 'draft']), args.repeat)
+        store.close()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scales', default='100,1000,10000',
+            help='comma separated numbers of todos, e.g. 100,1000,10000,100000,1000000')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per timing, for the phases that can be repeated')
+    parser.add_argument('--todos-per-note', type=int, default=20)
+    parser.add_argument('--todo-density', type=float, default=0.1, help='fraction of note lines that are todos')
+    parser.add_argument('--checked-ratio', type=float, default=0.3)
+    parser.add_argument('--todos-per-section', type=int, default=20, help='todos per date section of the todolist')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--only', choices=['sync', 'queries'], help='run only one group of benchmarks')
+    parser.add_argument('--out', default='bench.json', help='where to write the results')
+    args = parser.parse_args()
+
+    report = {'meta': {'date': datetime.now().isoformat(),
+                       'python': platform.python_version(),
+                       'platform': platform.platform(),
+                       'args': vars(args)},
+              'results': []}
+    for todos in [int(scale) for scale in args.scales.split(',')]:
+        for group, bench in [('sync', bench_sync), ('queries', bench_queries)]:
+            if args.only is not None and args.only != group:
+                continue
+            workdir = tempfile.mkdtemp(prefix='todofetcher-bench-')
+            try:
+                timings = bench(workdir, todos, args)
+            finally:
+                shutil.rmtree(workdir)
+            for phase in timings:
+                report['results'].append({'todos': todos, 'phase': phase,
+                        'seconds': timings[phase], 'best': min(timings[phase])})
+                print('{:>9} todos  {:<28} {:10.4f} s'.format(todos, phase, min(timings[phase])))
+
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=2)
+    print('results written to {}'.format(args.out))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Client side of server.py: sends a request over the Unix domain socket and
+returns the reply, or None when no server is running so that the caller does
+the work itself.
+"""
+import os
+import sys
+import json
+import socket
+from snapshot import DATA_DIR
+
+SOCKET_NAME = 'server.sock'
+
+def socket_path(data_dir=DATA_DIR):
+    return os.path.join(data_dir, SOCKET_NAME)
+
+def request(message, path=None):
+    """
+    sends message (a dictionary with an 'op') to the server and returns its
+    reply, a dictionary with the 'result' of the op and the 'output' it
+    printed. Returns None if no server is listening at path.
+    """
+    path = socket_path() if path is None else path
+    if not hasattr(socket, 'AF_UNIX') or not os.path.exists(path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError: # a socket left over by a server that is gone
+        sock.close()
+        return None
+    with sock:
+        sock.sendall((json.dumps(message) + '\n').encode('utf-8'))
+        with sock.makefile('rb') as f:
+            line = f.readline()
+    if not line:
+        return None
+    reply = json.loads(line.decode('utf-8'))
+    if not reply['ok']:
+        sys.stdout.write(reply['output'])
+        raise RuntimeError('server failed on {}: {}'.format(message['op'], reply['error']))
+    return reply
+
+class RemoteCheckOffWriter(object):
+    """
+    Same interface as utils.CheckOffWriter, for a session served by the
+    server: the check offs are sent to it to be written.
+    """
+    def __init__(self):
+        self.pending = []
+
+    def __len__(self):
+        return len(self.pending)
+
+    def add(self, todo_string):
+        self.pending.append(todo_string)
+
+    def flush(self):
+        """
+        sends the pending check offs to the server, or writes them here if the
+        server went away. Return true upon success, false otherwise.
+        """
+        if not len(self):
+            return True
+        todos, self.pending = self.pending, []
+        reply = request({'op': 'checkoff', 'todos': todos})
+        if reply is not None:
+            sys.stdout.write(reply['output'])
+            return reply['result']
+        from utils import CheckOffWriter
+        writer = CheckOffWriter()
+        for todo in todos:
+            writer.add(todo)
+        return writer.flush()
@@ -0,0 +1,75 @@
+"""
+Scoring and scheduling of the unchecked todos as numpy arrays, for large
+backlogs: the assign date ordinals, minutes and priorities of the todos are
+held in columns, and the aging, the threshold split and the pruning of what
+can't fit in the budget are done as array operations. Only the few todos left
+after pruning go through the scheduler.
+
+It picks the same todos as get_priorities and get_feasible_set in
+todofetcher.py. numpy is optional: importing this module raises ImportError
+without it, and todofetcher.py scores the todos one by one instead.
+"""
+from datetime import datetime
+import numpy as np
+from scheduler import DECAYS, SCHEDULERS
+from settings import current
+
+def todo_columns(todos):
+    """
+    the assign date ordinals and the minutes of todos, as int64 arrays.
+    """
+    ordinals = np.fromiter((todo.assign_ordinal for todo in todos), np.int64, len(todos))
+    minutes = np.fromiter((todo.minutes for todo in todos), np.int64, len(todos))
+    return ordinals, minutes
+
+def score(ordinals, today=None, decay='linear'):
+    """
+    the priorities of todos assigned on ordinals, aged to today (an ordinal).
+    """
+    today = datetime.now().date().toordinal() if today is None else today
+    return DECAYS[decay](today - ordinals)
+
+def prune(minutes, priorities, budget):
+    """
+    the indices, in order, of the todos that fit in budget, keeping for each
+    duration m > 0 only the budget // m best ones like scheduler.prune_items.
+    Todos that take no time are all kept.
+    """
+    fits = np.flatnonzero(minutes <= budget)
+    fit_minutes = minutes[fits]
+    # by minutes, then best first, then in order
+    order = np.lexsort((fits, -np.maximum(priorities[fits], 0), fit_minutes))
+    sorted_minutes = fit_minutes[order]
+    starts = np.flatnonzero(np.r_[True, sorted_minutes[1:] != sorted_minutes[:-1]])
+    ranks = np.arange(len(order)) - np.repeat(starts, np.diff(np.r_[starts, len(order)]))
+    limits = np.where(sorted_minutes > 0, budget // np.maximum(sorted_minutes, 1), len(order))
+    return np.sort(fits[order[ranks < limits]])
+
+def schedule(todos, budget_minutes, mode='knapsack', decay='linear', today=None, settings=None):
+    """
+    scores todos with decay and returns the list of Todos to work on within
+    budget_minutes, like get_priorities followed by get_feasible_set, and
+    whether the todos above the threshold alone took more than the budget.
+    Only the Todos returned get their priority set.
+    """
+    ordinals, minutes = todo_columns(todos)
+    priorities = score(ordinals, today, decay)
+    above = priorities > DECAYS[decay](current(settings).PRIORITY_THRESHOLD)
+    above_idx = np.flatnonzero(above)
+    total_minutes = int(minutes[above].sum())
+
+    over_budget = total_minutes > budget_minutes
+    feasible_idx = above_idx
+    if not over_budget:
+        remaining_idx = np.flatnonzero(~above)
+        kept = remaining_idx[prune(minutes[remaining_idx], priorities[remaining_idx],
+            budget_minutes - total_minutes)]
+        items = list(zip(kept.tolist(), minutes[kept].tolist(), priorities[kept].tolist()))
+        picked = [idx for idx, _, _ in SCHEDULERS[mode](items, budget_minutes - total_minutes)]
+        feasible_idx = np.r_[above_idx, np.array(picked, np.int64)]
+
+    feasible_set = []
+    for idx, priority in zip(feasible_idx.tolist(), priorities[feasible_idx].tolist()):
+        todos[idx].priority = priority
+        feasible_set.append(todos[idx])
+    return feasible_set, over_budget
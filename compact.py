@@ -0,0 +1,131 @@
+"""
+Compaction of the todolist: date sections whose todos are all checked off are
+moved out of the todolist into one archive file per year, and their todos are
+moved out of the todos table of the store, keeping the note they came from.
+"""
+import os
+from datetime import datetime
+from utils import iter_todolist, parse_mmddyy, classify_line, find_hex, atomic_write_lines
+from snapshot import write_snapshot
+from partitions import todolist_paths
+from textindex import TextIndex
+import profiling
+import config
+
+def split_sections(lines):
+    """
+    splits the lines of a todolist into the lines before the first date, and a
+    list of (date, lines) for every date section, in order.
+    """
+    preamble = []
+    sections = []
+    for line in lines:
+        date = parse_mmddyy(line)
+        if date is not None:
+            sections.append((date, [line]))
+        elif len(sections):
+            sections[-1][1].append(line)
+        else:
+            preamble.append(line)
+    return preamble, sections
+
+def section_hexes(section_lines):
+    """
+    returns whether every checklist item of a section is checked off (and
+    there is at least one), and the hex ids ('0x...') tagged in them.
+    """
+    items = 0
+    hex_ids = []
+    for line in section_lines:
+        idx, checked = classify_line(line)
+        if idx is None:
+            continue
+        if not checked:
+            return False, []
+        items += 1
+        found = find_hex(line)
+        if found is not None:
+            hex_ids.append('0x' + found['hex'])
+    return items > 0, hex_ids
+
+def archive_path(year, fpath=None, archive_dir=None):
+    """
+    the archive file for the sections of a year, e.g. todo_archive/todo-2020.md
+    """
+    fpath = config.TODOLIST_NAME if fpath is None else fpath
+    archive_dir = config.ARCHIVE_DIR if archive_dir is None else archive_dir
+    stem, ext = os.path.splitext(os.path.basename(fpath))
+    return os.path.join(archive_dir, '{}-{}{}'.format(stem, year, ext))
+
+def append_to_archive(path, sections):
+    """
+    adds sections (lists of lines) at the top of the archive file at path, so
+    that the newest sections come first like in the todolist. Sections already
+    in the archive, from a compaction that was interrupted, are left out.
+    """
+    old_lines = []
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8', newline='') as f:
+            old_lines = f.readlines()
+    old_content = ''.join(old_lines)
+    new_lines = []
+    for section in sections:
+        if not section[-1].endswith('\n'):
+            section = section[:-1] + [section[-1] + '\n']
+        if ''.join(section) not in old_content:
+            new_lines.extend(section)
+    if not len(new_lines):
+        return
+    if not os.path.exists(os.path.dirname(path) or '.'):
+        os.makedirs(os.path.dirname(path))
+    atomic_write_lines(path, new_lines + old_lines)
+
+def compact(store, fpath=None, archive_dir=None):
+    """
+    moves the date sections of the todolist at fpath that only hold checked
+    off todos, other than today's, into the archive files of their year.
+    Sections with a todo that is checked off in the todolist but not yet in
+    its note are kept until the next sync. Returns the number of sections
+    archived.
+    """
+    fpath = config.TODOLIST_NAME if fpath is None else fpath
+    today = datetime.now().date()
+    with profiling.phase('compact_read'):
+        with open(fpath, 'r', encoding='utf-8', newline='') as f:
+            preamble, sections = split_sections(f.readlines())
+
+    year2sections = {}
+    archived_hexes = {}
+    kept = list(preamble)
+    for date, section_lines in sections:
+        done, hex_ids = section_hexes(section_lines)
+        if done and date.date() < today and not len(store.get_uncompleted_paths(hex_ids)):
+            year2sections.setdefault(date.year, []).append(section_lines)
+            archived_hexes.setdefault(date.year, []).extend(hex_ids)
+        else:
+            kept.extend(section_lines)
+    if not len(year2sections):
+        print('nothing to compact')
+        return 0
+
+    # the unchecked todos stay the same, so an up to date text index stays so
+    text_index = TextIndex(store, todolist_paths())
+    text_index_current = text_index.is_current()
+    with profiling.phase('compact_write'):
+        # the archives are written first, so that an interruption never loses a section
+        for year in sorted(year2sections):
+            append_to_archive(archive_path(year, fpath, archive_dir), year2sections[year])
+        atomic_write_lines(fpath, kept)
+
+    with profiling.phase('compact_store'), store.transaction():
+        archived = 0
+        for year in sorted(archived_hexes):
+            archived += store.archive_todos(archived_hexes[year], archive_path(year, fpath, archive_dir))
+        if text_index_current:
+            text_index.mark_current()
+    write_snapshot(iter_todolist(fpath), fpath, data_dir=store.data_dir)
+
+    moved = sum([len(year2sections[year]) for year in year2sections])
+    print('archived {} sections ({} todos in the store) into {}'.format(moved, archived,
+        ', '.join(archive_path(year, fpath, archive_dir) for year in sorted(year2sections))))
+    return moved
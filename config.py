@@ -6,3 +6,18 @@ CHECKLIST_UNCHECKED_MARKERS = ['* [ ]']
 HEX_START = 0
 HEX_BITS = 8
 PRIORITY_THRESHOLD = 3 
+ARCHIVE_DIR = 'todo_archive'
+# one todolist per notes directory, in PARTITION_DIR, instead of TODOLIST_NAME
+PARTITION_TODOLISTS = False
+PARTITION_DIR = 'todo_partitions'
+# notes directory -> partition name, for directories that share a partition
+PARTITION_NAMES = {}
+# notes (or directories) matching any of these globs, by path or name, are left out
+SCAN_EXCLUDE = []
+# if not empty, only the notes matching one of these globs are synced
+SCAN_INCLUDE = []
+# notes bigger than this many bytes are left out (None for no limit)
+MAX_NOTE_SIZE = None
+# only stat the notes of directories that changed, for editors that save by
+# replacing the file rather than writing over it
+SCAN_TRUST_DIR_MTIME = False
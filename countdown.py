@@ -0,0 +1,128 @@
+"""
+Countdown timer for a todo, on an asyncio event loop so that other tasks (like
+writing the check offs of the session) can run while it counts.
+"""
+import sys
+import math
+import time
+import signal
+import asyncio
+from datetime import timedelta
+from termcolor import colored
+from scheduler import duration2datetime
+
+# seconds between writes of the check offs made during a session
+FLUSH_INTERVAL = 60
+
+MENU = """
+Time out.
+Options:
+1) Add more time [a]
+2) Check off item [c]
+3) Continue [n]
+4) Cancel [x]
+                """
+
+async def ask(loop, prompt=None):
+    """
+    input() in a worker thread, so that the event loop keeps running.
+    """
+    if prompt is not None:
+        print(prompt)
+    return await loop.run_in_executor(None, input)
+
+class CountDown(object):
+    """
+    Counts down from starting_time against a time.monotonic deadline, so that
+    the time spent redrawing doesn't add up, and redraws only when the seconds
+    shown change. Ctrl-C pauses it and opens the menu.
+    """
+    def __init__(self, starting_time):
+        self.starting_time = starting_time
+        self.current_time = starting_time
+        self.return_time = timedelta(seconds=0)
+
+    def start(self):
+        """
+        runs the countdown on its own event loop.
+        """
+        return asyncio.run(self.run())
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        interrupted = asyncio.Event()
+        try:
+            loop.add_signal_handler(signal.SIGINT, interrupted.set)
+            handles_sigint = True
+        except (NotImplementedError, RuntimeError):
+            # no signal handlers on this platform, Ctrl-C ends the session
+            handles_sigint = False
+        try:
+            while True:
+                if await self.count_down(interrupted):
+                    return {'status': 'out-of-time'}
+                status = await self.menu(loop)
+                interrupted.clear()
+                if status is not None:
+                    return status
+        finally:
+            if handles_sigint:
+                loop.remove_signal_handler(signal.SIGINT)
+
+    async def count_down(self, interrupted):
+        """
+        counts current_time down to return_time, and returns True when the
+        time is up, or False as soon as interrupted is set.
+        """
+        deadline = time.monotonic() + (self.current_time - self.return_time).total_seconds()
+        shown = None
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.current_time = self.return_time
+                return True
+            seconds = math.ceil(remaining)
+            if seconds != shown:
+                shown = seconds
+                sys.stdout.write('\r{}'.format(colored(str(self.return_time + timedelta(seconds=seconds)), 'red')))
+                sys.stdout.flush()
+            try:
+                # sleeps until the seconds shown change
+                await asyncio.wait_for(interrupted.wait(), remaining - (seconds - 1))
+            except asyncio.TimeoutError:
+                continue
+            remaining = max(deadline - time.monotonic(), 0)
+            self.current_time = self.return_time + timedelta(seconds=math.ceil(remaining))
+            return False
+
+    async def menu(self, loop):
+        """
+        the countdown is paused while the menu is open. Returns the status to
+        end the countdown with, or None to keep counting.
+        """
+        options = (await ask(loop, MENU)).lower().strip()
+        if options == 'a':
+            print ("how much more time?")
+            while True:
+                try:
+                    time_str = await ask(loop)
+                    extratime = duration2datetime(time_str)
+                    self.current_time += extratime
+                    break
+                except (ValueError, AssertionError):
+                    print('Invalid. Try again.')
+        elif options == 'c':
+            return {'status': 'complete',
+                    'remaining_time': self.current_time}
+        elif options == 'x':
+            return {'status': 'term'}
+        # [n] and anything else: continue
+        return None
+
+async def flush_periodically(flush, interval=FLUSH_INTERVAL):
+    """
+    calls flush every interval seconds, until cancelled.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        flush()
@@ -0,0 +1,104 @@
+"""
+Partitioned todolists: with config.PARTITION_TODOLISTS, the todos of every
+notes directory go into a todolist of their own in config.PARTITION_DIR
+(e.g. todo_partitions/travis.md) instead of config.TODOLIST_NAME. A sync then
+only rewrites the partitions that get new todos, and todofetcher.py reads the
+partitions together.
+
+Without partitions, the only todolist is config.TODOLIST_NAME. With them, an
+existing config.TODOLIST_NAME is still read along with the partitions, so the
+todos in it can be checked off and looked up, but no new todos go into it.
+"""
+import os
+from settings import current, located
+
+def partitioned(settings=None):
+    return current(settings).PARTITION_TODOLISTS
+
+def partition_name(notes_dir, settings=None):
+    """
+    the name of the partition of a notes directory: its entry in
+    config.PARTITION_NAMES, for directories that share a partition, or the
+    directory itself.
+    """
+    conf = current(settings)
+    if notes_dir in conf.PARTITION_NAMES:
+        return conf.PARTITION_NAMES[notes_dir]
+    return os.path.normpath(notes_dir).replace(os.sep, '_')
+
+def partition_path(notes_dir, settings=None):
+    """
+    the todolist of the partition of a notes directory, e.g.
+    todo_partitions/travis.md
+    """
+    conf = current(settings)
+    ext = os.path.splitext(conf.TODOLIST_NAME)[1]
+    return os.path.join(conf.PARTITION_DIR, partition_name(notes_dir, settings) + ext)
+
+def todolist_for_note(note, settings=None):
+    """
+    the todolist that the new todos of the note at path note go into.
+    """
+    conf = current(settings)
+    if not partitioned(settings):
+        return conf.TODOLIST_NAME
+    note = os.path.normpath(note)
+    best = None
+    for notes_dir in conf.NOTES_DIRS:
+        # the innermost directory, for notes directories inside others
+        if note.startswith(os.path.normpath(notes_dir) + os.sep) \
+                and (best is None or len(notes_dir) > len(best)):
+            best = notes_dir
+    # notes outside of the notes directories (given to the watcher) keep to the main todolist
+    return conf.TODOLIST_NAME if best is None else partition_path(best, settings)
+
+def todolist_paths(existing=True, settings=None):
+    """
+    the todolists to read, in order: the partitions that exist (in the order
+    of config.NOTES_DIRS), and config.TODOLIST_NAME. With existing=False, the
+    partitions that don't exist yet are included.
+    """
+    conf = current(settings)
+    if not partitioned(settings):
+        return [conf.TODOLIST_NAME]
+    paths = []
+    for notes_dir in conf.NOTES_DIRS:
+        path = partition_path(notes_dir, settings)
+        if path not in paths and (not existing or os.path.exists(located(path, settings))):
+            paths.append(path)
+    if not existing or os.path.exists(located(conf.TODOLIST_NAME, settings)):
+        paths.append(conf.TODOLIST_NAME)
+    return paths
+
+def ensure_todolist(fpath, settings=None):
+    """
+    creates an empty todolist with a #TODO header at fpath if there is none.
+    """
+    fpath = located(fpath, settings)
+    if os.path.exists(fpath):
+        return
+    if os.path.dirname(fpath) and not os.path.exists(os.path.dirname(fpath)):
+        os.makedirs(os.path.dirname(fpath))
+    with open(fpath, 'w') as f:
+        f.write('#TODO\n')
+
+def split_by_todolist(note2newtodos_w_hashes, settings=None):
+    """
+    splits a dictionary of note -> new todos into one per todolist they go
+    into, keeping the order of the notes.
+    """
+    todolist2notes = {}
+    for note in note2newtodos_w_hashes:
+        todolist2notes.setdefault(todolist_for_note(note, settings), {})[note] = note2newtodos_w_hashes[note]
+    return todolist2notes
+
+def todolists_signature(fpaths, settings=None):
+    """
+    the (size, mtime_ns) of each of the todolists at fpaths, which changes
+    when any of them does.
+    """
+    signatures = []
+    for fpath in fpaths:
+        st = os.stat(located(fpath, settings))
+        signatures.append((fpath, st.st_size, st.st_mtime_ns))
+    return tuple(signatures)
@@ -0,0 +1,97 @@
+"""
+Wall time per phase and work counters, turned on with --profile.
+
+When profiling is off, phase() hands back a shared no-op context manager and
+count() returns right away, so the instrumentation costs next to nothing.
+"""
+import sys
+import time
+
+ENABLED = False
+# phase name -> [total seconds, number of calls]
+phase_times = {}
+# counter name -> total
+counters = {}
+
+class NullPhase(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NULL_PHASE = NullPhase()
+
+class Phase(object):
+    __slots__ = ('name', 'tic')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.tic = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.tic
+        totals = phase_times.setdefault(self.name, [0.0, 0])
+        totals[0] += elapsed
+        totals[1] += 1
+        return False
+
+def enable():
+    global ENABLED
+    ENABLED = True
+
+def phase(name):
+    """
+    context manager timing the code inside it as one call of phase `name`.
+    """
+    if not ENABLED:
+        return NULL_PHASE
+    return Phase(name)
+
+def count(name, n=1):
+    """
+    adds n to counter `name`. Should only be called from the main thread.
+    """
+    if ENABLED:
+        counters[name] = counters.get(name, 0) + n
+
+def summary():
+    return {'phases': {name: {'seconds': phase_times[name][0], 'calls': phase_times[name][1]} \
+                for name in phase_times},
+            'counters': dict(counters)}
+
+def format_table():
+    lines = ['{:<32} {:>10} {:>7}'.format('phase', 'seconds', 'calls')]
+    for name in sorted(phase_times, key=lambda name: -phase_times[name][0]):
+        lines.append('{:<32} {:>10.4f} {:>7}'.format(name, phase_times[name][0], phase_times[name][1]))
+    lines.append('')
+    lines.append('{:<32} {:>18}'.format('counter', 'total'))
+    for name in sorted(counters):
+        lines.append('{:<32} {:>18}'.format(name, counters[name]))
+    return '\n'.join(lines)
+
+def report(fmt='table', out=None):
+    """
+    prints the phases and counters recorded so far, as a table or as json.
+    """
+    out = sys.stderr if out is None else out
+    if fmt == 'json':
+        import json
+        out.write(json.dumps(summary(), indent=2) + '\n')
+    else:
+        out.write(format_table() + '\n')
+
+def enable_from_argv(argv):
+    """
+    turns profiling on if `--profile` or `--profile=json` is in argv, removing
+    it, and returns the report format (None when profiling stays off).
+    """
+    for idx, arg in enumerate(argv):
+        if arg == '--profile' or arg.startswith('--profile='):
+            del argv[idx]
+            enable()
+            return arg.partition('=')[2] or 'table'
+    return None
@@ -0,0 +1,130 @@
+"""
+Rebuild of the todos table of the store from the hex tags written in the
+notes, for after the notes were reorganized in a way the syncs couldn't follow
+(or the store was lost):
+
+    python todolist.py --rebuild [--jobs N]
+
+Every note under config.NOTES_DIRS is searched for {0x...} tags by a pool of
+processes, and each todo found gets the note it is in and its checkbox state.
+Todos tagged in more than one place, and the todos of the store that aren't
+checked off and are in no note, are reported.
+"""
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from scanner import list_notes
+from shard import chunk_size
+from utils import map_file, get_bytes_marker_matcher, note_signature, format_hex
+import profiling
+import config
+
+# ids listed in the report, beyond which only the counts are printed
+REPORT_LIMIT = 20
+
+def tag_pattern():
+    return re.compile(rb'\{0x([0-9A-Fa-f]{%d})' % config.HEX_BITS)
+
+def note_tags(note):
+    """
+    runs in a worker: the signature of the note, and a (hex id, checked,
+    offset of the checklist marker) for every tagged checklist item in it.
+    Only the lines with a tag are looked at.
+    """
+    pattern, marker2kind = get_bytes_marker_matcher()
+    tags = []
+    try:
+        with open(note, 'rb') as f:
+            signature = note_signature(note)
+            mm = map_file(f)
+            if mm is None:
+                return signature, tags
+            with mm:
+                for tag in tag_pattern().finditer(mm):
+                    line_start = mm.rfind(b'\n', 0, tag.start()) + 1
+                    match = pattern.search(mm, line_start, tag.start())
+                    if match is not None:
+                        tags.append(('0x' + tag.group(1).decode('ascii'),
+                            marker2kind[match.group(0)][0], match.start()))
+    except FileNotFoundError: # removed since it was listed
+        return None, tags
+    return signature, tags
+
+def find_tags(notes, jobs):
+    """
+    yields (note, signature, tags) for every note, in order, with the notes
+    searched by `jobs` processes.
+    """
+    if jobs <= 1:
+        for note in notes:
+            yield (note,) + note_tags(note)
+        return
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        for note, result in zip(notes, pool.map(note_tags, notes, chunksize=chunk_size(notes, jobs))):
+            yield (note,) + result
+
+def report(title, hex_ids, describe):
+    if not len(hex_ids):
+        return
+    print('{} {}:'.format(len(hex_ids), title))
+    for hex_id in sorted(hex_ids)[:REPORT_LIMIT]:
+        print('  {} {}'.format(hex_id, describe(hex_id)))
+    if len(hex_ids) > REPORT_LIMIT:
+        print('  ...')
+
+def rebuild(store, jobs=None, dirs=None):
+    """
+    points every todo tagged in the notes under dirs (config.NOTES_DIRS by
+    default) at the note it is in, with its completion from its checkbox, and
+    refreshes the hex offset index of the notes. A todo tagged in several
+    places goes with the first note in path order. Returns the dictionary of
+    hex id -> list of (note, checked) of the tags found.
+    """
+    jobs = (os.cpu_count() or 1) if jobs is None else jobs
+    dirs = config.NOTES_DIRS if dirs is None else dirs
+    with profiling.phase('rebuild_list_notes'):
+        notes = list_notes(dirs)
+    hex2places = {}
+    path2index = {}
+    with profiling.phase('rebuild_find_tags'):
+        for note, signature, tags in find_tags(notes, jobs):
+            if signature is None:
+                continue
+            profiling.count('bytes_read', signature[0])
+            hex2offset = {}
+            for hex_id, checked, offset in tags:
+                # only the note a todo goes with indexes it
+                if hex_id not in hex2places:
+                    hex2offset[hex_id] = offset
+                hex2places.setdefault(hex_id, []).append((note, checked))
+            path2index[note] = (signature, hex2offset)
+
+    with profiling.phase('rebuild_store'), store.transaction():
+        hex2state = store.get_todos()
+        archived = store.get_archived_paths()
+        moved = [hex_id for hex_id in hex2places if hex_id in hex2state \
+                and hex2state[hex_id] != hex2places[hex_id][0]]
+        added = [hex_id for hex_id in hex2places if hex_id not in hex2state and hex_id not in archived]
+        # completed todos of notes that were deleted don't matter any more
+        orphans = [hex_id for hex_id in hex2state if hex_id not in hex2places and not hex2state[hex_id][1]]
+        # only the todos whose note or checkbox changed are written
+        changed = moved + added + [hex_id for hex_id in hex2places \
+                if hex_id in archived and archived[hex_id] != hex2places[hex_id][0][0]]
+        store.relocate_todos({hex_id: hex2places[hex_id][0] for hex_id in changed})
+        store.set_all_hex_offsets(path2index)
+        # new ids must not collide with the ones found
+        if len(hex2places):
+            hex_start = max(int(hex_id, 16) for hex_id in hex2places) + 1
+            if hex_start > config.HEX_START:
+                print('HEX_START moved from {} to {}'.format(format_hex(config.HEX_START), format_hex(hex_start)))
+                config.HEX_START = hex_start
+                store.set_hex_start(hex_start)
+
+    duplicates = [hex_id for hex_id in hex2places if len(hex2places[hex_id]) > 1]
+    print('found {} tagged todos in {} notes: {} relocated or updated, {} added'.format(
+        len(hex2places), len(notes), len(moved), len(added)))
+    report('todos tagged in more than one place', duplicates,
+            lambda hex_id: ', '.join(note for note, _ in hex2places[hex_id]))
+    report('unchecked todos in no note, left as they were', orphans,
+            lambda hex_id: 'last seen in {}'.format(hex2state[hex_id][0]))
+    return hex2places
@@ -0,0 +1,300 @@
+"""
+Scanning the notes directories for notes that need to be synced.
+
+A DirManifest remembers the mtime, subdirectories and notes of every directory
+as it was last listed. A directory whose mtime hasn't moved since is not
+listed again, as files are only added, removed or renamed in it by changing
+its mtime. The notes in it are still stat'd, since editing a note in place
+doesn't change the mtime of its directory, unless config.SCAN_TRUST_DIR_MTIME
+is set (for editors that save by replacing the file).
+"""
+import os
+import time
+import hashlib
+from fnmatch import fnmatch
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime
+from utils import ends_in_exts
+from settings import current, located
+import profiling
+
+SCAN_WORKERS = 8
+DIGEST_CHUNK = 1 << 20
+# directories modified this recently (in ns) are listed again next time, as
+# another change within the resolution of their mtime wouldn't move it
+RACY_MTIME_NS = 2 * 10**9
+
+# a note whose modification date is newer than the one recorded. changed is
+# false when only the modification date moved, and the content is the same.
+NoteScan = namedtuple('NoteScan', ['path', 'modtime', 'size', 'digest', 'changed'])
+
+def file_digest(filepath):
+    """
+    returns a fast digest of the content of a file, as a hex string.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    with open(filepath, 'rb') as f:
+        chunk = f.read(DIGEST_CHUNK)
+        while chunk:
+            h.update(chunk)
+            chunk = f.read(DIGEST_CHUNK)
+    return h.hexdigest()
+
+def matches_any(path, globs):
+    """
+    whether a glob matches the path (e.g. travis/attachments) or the name
+    (attachments) of a note or directory.
+    """
+    name = os.path.basename(path)
+    return any(fnmatch(path, glob) or fnmatch(name, glob) for glob in globs)
+
+def wanted_dir(path, settings=None):
+    return not matches_any(path, current(settings).SCAN_EXCLUDE)
+
+def wanted_note(path, settings=None):
+    """
+    whether the file at path is a note, going by its name: it has one of the
+    config.VALID_EXT extensions, and the include and exclude globs let it in.
+    """
+    conf = current(settings)
+    if not ends_in_exts(path, conf.VALID_EXT) or matches_any(path, conf.SCAN_EXCLUDE):
+        return False
+    return not len(conf.SCAN_INCLUDE) or matches_any(path, conf.SCAN_INCLUDE)
+
+def wanted_subdir(path, settings=None):
+    """
+    whether the walk of the notes directories goes into the directory at
+    path, going by its name: it isn't hidden, and no exclude glob matches it.
+    """
+    return not os.path.basename(path).startswith('.') and wanted_dir(path, settings)
+
+def wanted_path(path, settings=None):
+    """
+    whether the walk of the notes directories would find the note at path,
+    going by its path: the note is wanted, and so is every directory between
+    it and a notes directory it is in. Notes outside of the notes directories
+    only have to be wanted themselves.
+    """
+    if os.path.basename(path).startswith('.') or not wanted_note(path, settings):
+        return False
+    path = os.path.normpath(path)
+    in_notes_dirs = False
+    for notes_dir in current(settings).NOTES_DIRS:
+        notes_dir = os.path.normpath(notes_dir)
+        if not path.startswith(notes_dir + os.sep):
+            continue
+        in_notes_dirs = True
+        d = os.path.dirname(path)
+        while len(d) > len(notes_dir) and wanted_subdir(d, settings):
+            d = os.path.dirname(d)
+        if len(d) <= len(notes_dir):
+            return True
+    return not in_notes_dirs
+
+def wanted_size(st, settings=None):
+    conf = current(settings)
+    return conf.MAX_NOTE_SIZE is None or st.st_size <= conf.MAX_NOTE_SIZE
+
+def manifest_key(settings=None):
+    """
+    the settings that the entries of the manifest were listed with. The
+    manifest is dropped when they change.
+    """
+    conf = current(settings)
+    return repr((conf.VALID_EXT, conf.SCAN_INCLUDE, conf.SCAN_EXCLUDE))
+
+class DirManifest(object):
+    """
+    directory path -> (mtime_ns, subdirectory paths, note names) as the
+    directory was last listed, and which entries changed since it was loaded
+    (dirty) or saved (removed), to be written back to the store.
+    """
+    def __init__(self, entries=None):
+        self.entries = {} if entries is None else entries
+        self.dirty = set()
+        self.removed = set()
+
+    def get(self, d, mtime_ns):
+        """
+        the entry of d if d hasn't been modified since it was listed, or None.
+        """
+        entry = self.entries.get(d)
+        if entry is None or entry[0] != mtime_ns:
+            return None
+        return entry
+
+    def set(self, d, entry):
+        self.entries[d] = entry
+        self.dirty.add(d)
+        self.removed.discard(d)
+
+    def prune(self, visited):
+        """
+        forgets the directories that weren't visited by the last walk.
+        """
+        for d in [d for d in self.entries if d not in visited]:
+            del self.entries[d]
+            self.dirty.discard(d)
+            self.removed.add(d)
+
+def scan_note(path, st, path2modtime, path2fingerprint, settings=None):
+    """
+    returns a NoteScan for the note at path, with stat result st, if it is new
+    or has been modified since the time in path2modtime, and None otherwise.
+    The digest is only computed for those notes.
+    """
+    mdate = datetime.fromtimestamp(st.st_mtime)
+    if path in path2modtime and not mdate > path2modtime[path]:
+        return None
+    try:
+        digest = file_digest(located(path, settings))
+    except FileNotFoundError: # removed since it was listed
+        return None
+    changed = path2fingerprint.get(path) != (st.st_size, digest)
+    return NoteScan(path, mdate, st.st_size, digest, changed)
+
+def list_dir(d, settings=None):
+    """
+    lists a single directory with os.scandir, and returns its mtime_ns, the
+    subdirectories in it, and the names of the notes in it, or None if it
+    can't be listed.
+    """
+    try:
+        mtime_ns = os.stat(located(d, settings)).st_mtime_ns
+        entries = list(os.scandir(located(d, settings)))
+    except (FileNotFoundError, NotADirectoryError, PermissionError):
+        print('WARNING: cannot list {}'.format(d))
+        return None
+    subdirs = []
+    names = []
+    for entry in entries:
+        if entry.name.startswith('.'):
+            continue
+        # relative to the root, like d
+        path = os.path.join(d, entry.name)
+        if entry.is_dir(follow_symlinks=False):
+            if wanted_dir(path, settings):
+                subdirs.append(path)
+        elif wanted_note(path, settings) and entry.is_file():
+            names.append(entry.name)
+    return mtime_ns, subdirs, names
+
+def scan_dir(d, path2modtime, path2fingerprint, manifest=None, settings=None):
+    """
+    lists a single directory, unless manifest says it is unchanged, and
+    returns a tuple of the subdirectories found, the paths of all the notes
+    in d, a NoteScan for each note in d that has been modified since the time
+    in path2modtime, the new manifest entry of d (None when it wasn't
+    listed), and the number of notes stat'd. With path2modtime None, the
+    notes are only listed.
+    """
+    entry = None
+    if manifest is not None:
+        try:
+            entry = manifest.get(d, os.stat(located(d, settings)).st_mtime_ns)
+        except (FileNotFoundError, NotADirectoryError, PermissionError):
+            entry = None
+    listed = entry is None
+    if listed:
+        entry = list_dir(d, settings)
+        if entry is None:
+            return [], [], [], None, 0
+        if time.time_ns() - entry[0] < RACY_MTIME_NS:
+            entry = (None,) + entry[1:]
+    _, subdirs, names = entry
+
+    seen = []
+    modified = []
+    statted = 0
+    for name in names:
+        path = os.path.join(d, name)
+        if path2modtime is None:
+            seen.append(path)
+            continue
+        if not listed and current(settings).SCAN_TRUST_DIR_MTIME and path in path2modtime:
+            # nothing was saved over it since it was last synced
+            seen.append(path)
+            continue
+        try:
+            st = os.stat(located(path, settings))
+        except FileNotFoundError:
+            continue
+        statted += 1
+        if not wanted_size(st, settings):
+            continue
+        seen.append(path)
+        note = scan_note(path, st, path2modtime, path2fingerprint, settings)
+        if note is not None:
+            modified.append(note)
+    return subdirs, seen, modified, entry if listed else None, statted
+
+def find_modified_notes(dirs, path2modtime, path2fingerprint={}, max_workers=SCAN_WORKERS, manifest=None,
+        settings=None):
+    """
+    recursively walks every directory in dirs with a thread pool. Returns a
+    sorted list of NoteScans for the notes that are new or have been modified
+    since the times in path2modtime, where path2fingerprint holds the last
+    known (size, digest) of each note, and the set of paths of all the notes
+    found. The directories unchanged since they were recorded in manifest (a
+    DirManifest, updated in place) aren't listed.
+    """
+    assert type(dirs) is list
+    seen = set()
+    modified = []
+    visited = set()
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        pending = {pool.submit(scan_dir, d, path2modtime, path2fingerprint, manifest, settings): d for d in dirs}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                d = pending.pop(future)
+                subdirs, found, notes, entry, statted = future.result()
+                visited.add(d)
+                if manifest is not None and entry is not None:
+                    manifest.set(d, entry)
+                seen.update(found)
+                modified.extend(notes)
+                # counted here, the counters aren't shared with the workers
+                if entry is not None or manifest is None:
+                    profiling.count('dirs_listed')
+                profiling.count('files_statted', statted)
+                profiling.count('bytes_read', sum(note.size for note in notes))
+                for subdir in subdirs:
+                    pending[pool.submit(scan_dir, subdir, path2modtime, path2fingerprint, manifest, settings)] = subdir
+    if manifest is not None:
+        manifest.prune(visited)
+    return sorted(modified), seen
+
+def list_notes(dirs, max_workers=SCAN_WORKERS):
+    """
+    the sorted paths of all the notes under dirs, walked like
+    find_modified_notes but without reading any of them.
+    """
+    _, seen = find_modified_notes(dirs, None, max_workers=max_workers)
+    return sorted(seen)
+
+def scan_paths(paths, path2modtime, path2fingerprint={}, settings=None):
+    """
+    like find_modified_notes, but only looks at the given paths instead of
+    walking the notes directories. Paths that don't exist, or that the walk
+    wouldn't find, are left out of the set of notes found.
+    """
+    seen = set()
+    modified = []
+    for path in paths:
+        if not wanted_path(path, settings):
+            continue
+        try:
+            st = os.stat(located(path, settings))
+        except FileNotFoundError:
+            continue
+        profiling.count('files_statted')
+        if not wanted_size(st, settings):
+            continue
+        seen.add(path)
+        note = scan_note(path, st, path2modtime, path2fingerprint, settings)
+        if note is not None:
+            profiling.count('bytes_read', note.size)
+            modified.append(note)
+    return sorted(modified), seen
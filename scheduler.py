@@ -0,0 +1,174 @@
+"""
+Parsing durations, and picking which todos to work on within a time budget.
+
+Every scheduler takes a list of (key, minutes, priority) tuples and a budget
+in integer minutes, and returns the list of tuples it picked.
+
+Every decay takes the age of todos in days, as an int or a numpy array, and
+returns their priority; it has to grow with the age.
+"""
+import heapq
+from math import gcd
+from datetime import datetime, timedelta
+
+def durationlist2datetime(duration_split):
+    """
+    duration string split (by spaces) list to datetime object.
+    """
+    assert len(duration_split)%2 == 0
+    digits = []
+    if len(duration_split) == 4:
+        # case # h # m
+        digits = [int(duration_split[0]), int(duration_split[2])] 
+    elif len(duration_split) == 2:
+        if duration_split[1] == 'm':
+            digits = [0, int(duration_split[0])]
+        elif duration_split[1] == 'h':
+            digits = [int(duration_split[0]), 0]
+        else:
+            raise ValueError('duration string should be in the form # m, # h, or # h # m')
+    assert len(digits) != 0
+    duration_datetime = timedelta(hours = digits[0], minutes=digits[1])# datetime.strptime('::'.join(digits),'%H::%M')
+    return duration_datetime 
+
+def duration2datetime(duration_str):
+    """
+    Duration string to datetime object.
+    """ 
+    duration_split = duration_str.split()
+    return durationlist2datetime(duration_split)
+
+class Todo(object):
+    """
+    An unchecked todo as it is scheduled: the duration in whole minutes, the
+    date it was assigned as a date ordinal, and the hex id as an int (None
+    for todos without one).
+    """
+    __slots__ = ('text', 'hex', 'assign_ordinal', 'minutes', 'priority')
+
+    def __init__(self, text, hex=None, assign_ordinal=None, minutes=0, priority=0):
+        self.text = text
+        self.hex = hex
+        self.assign_ordinal = assign_ordinal
+        self.minutes = minutes
+        self.priority = priority
+
+    @property
+    def duration(self):
+        return timedelta(minutes=self.minutes)
+
+    @property
+    def assign_date(self):
+        return datetime.fromordinal(self.assign_ordinal)
+
+    def __repr__(self):
+        return 'Todo({!r}, {}, {}, {}, {})'.format(self.text, self.hex, self.assign_ordinal,
+                self.minutes, self.priority)
+
+def to_minutes(duration):
+    """
+    timedelta to integer minutes.
+    """
+    return int(duration.total_seconds() // 60)
+
+# days for the priority of a todo to double, with the exponential decay
+DOUBLING_DAYS = 7
+
+def linear_decay(age):
+    """
+    the priority is the number of days since the todo was assigned.
+    """
+    return age
+
+def exponential_decay(age):
+    """
+    the priority doubles every DOUBLING_DAYS days since the todo was assigned,
+    so that old todos win over several new ones.
+    """
+    return 2.0 ** (age / DOUBLING_DAYS)
+
+DECAYS = {'linear': linear_decay,
+          'exponential': exponential_decay}
+
+def schedule_heap(items, budget):
+    """
+    Repeatedly picks the highest priority todo that still fits in the
+    remaining budget, like the original greedy loop, but in O(n log n): once a
+    todo doesn't fit it never will, so each todo is popped at most once.
+    """
+    heap = [(-max(priority, 0), idx) for idx, (_, _, priority) in enumerate(items)]
+    heapq.heapify(heap)
+    chosen = []
+    remaining = budget
+    while heap:
+        _, idx = heapq.heappop(heap)
+        if items[idx][1] <= remaining:
+            chosen.append(items[idx])
+            remaining -= items[idx][1]
+    return chosen
+
+def prune_items(items, budget):
+    """
+    keeps, for each duration m, only the budget // m best todos of that
+    duration; no schedule can fit more of them, and any other todo of the same
+    duration can be swapped for a better one. Todos that don't fit at all are
+    dropped.
+    """
+    by_minutes = {}
+    for idx, item in enumerate(items):
+        if 0 < item[1] <= budget:
+            by_minutes.setdefault(item[1], []).append((-max(item[2], 0), idx))
+    kept = []
+    for minutes in by_minutes:
+        kept.extend(idx for _, idx in sorted(by_minutes[minutes])[:budget // minutes])
+    return [items[idx] for idx in sorted(kept)]
+
+def schedule_knapsack(items, budget):
+    """
+    0/1 knapsack over integer minutes: picks the todos with the largest total
+    priority that fit in budget and, among those, the ones that use the most
+    of it. Todos that take no time are always picked.
+    """
+    # when everything fits there is nothing to choose, e.g. for the matches
+    # of todofetcher.py -s/-k, which get their total as the budget
+    if sum(item[1] for item in items if item[1] > 0) <= budget:
+        return list(items)
+    chosen = [item for item in items if item[1] <= 0]
+    items = prune_items(items, budget)
+    if not len(items):
+        return chosen
+
+    # work in units of the largest step that all durations are a multiple of
+    step = budget
+    for item in items:
+        step = gcd(step, item[1])
+    step = max(step, 1)
+    capacity = budget // step
+
+    best = [0] * (capacity + 1) # best[t] = best total priority within t units
+    # the units used by best[t], which only break ties between equal totals
+    # (the priorities can be floats, e.g. with exponential_decay)
+    used = [0] * (capacity + 1)
+    taken = []
+    for _, minutes, priority in items:
+        units = minutes // step
+        priority = max(priority, 0)
+        took = bytearray(capacity + 1)
+        for t in range(capacity, units - 1, -1):
+            candidate = best[t - units] + priority
+            if candidate > best[t] or (candidate == best[t] and used[t - units] + units > used[t]):
+                best[t] = candidate
+                used[t] = used[t - units] + units
+                took[t] = 1
+        taken.append(took)
+
+    picked = []
+    t = capacity
+    for idx in range(len(items) - 1, -1, -1):
+        if taken[idx][t]:
+            picked.append(items[idx])
+            t -= items[idx][1] // step
+    return chosen + picked[::-1]
+
+SCHEDULERS = {'knapsack': schedule_knapsack,
+              'heap': schedule_heap}
@@ -0,0 +1,129 @@
+"""
+Resident server that keeps the sync state, the unchecked todos and the text
+index in memory, and serves todolist.py and todofetcher.py over a Unix domain
+socket in the data directory.
+
+    python server.py
+
+Every request and reply is a single line of JSON. A request names its 'op'
+(sync, schedule, search, checkoff or ping), and the reply holds its 'result'
+and whatever it printed as 'output'. The CLIs use the server when it runs, and
+do the work themselves otherwise.
+"""
+import os
+import io
+import json
+import signal
+import contextlib
+import socketserver
+from store import IndexStore, DATA_DIR
+from snapshot import snapshot_rows
+from partitions import todolist_paths, todolists_signature
+from client import socket_path, request
+from utils import CheckOffWriter
+from todolist import sync
+from todofetcher import load_todos, search_records, schedule, refresh_snapshot
+import config
+
+OPS = ['sync', 'schedule', 'search', 'checkoff', 'ping']
+
+class TodoServer(object):
+    """
+    The state kept between requests, and a handler for each op.
+    """
+    def __init__(self, data_dir=DATA_DIR):
+        self.store = IndexStore(data_dir)
+        self.path2modtime = self.store.get_modtimes()
+        self.path2fingerprint = self.store.get_fingerprints()
+        self.todos = None
+        self.todos_signature = None
+
+    def current_todos(self):
+        """
+        the unchecked todos, reloaded only when the todolist changed.
+        """
+        signature = todolists_signature(todolist_paths())
+        if self.todos is None or signature != self.todos_signature:
+            self.todos = load_todos(self.store.data_dir)
+            self.todos_signature = signature
+        return self.todos
+
+    def handle(self, message):
+        out = io.StringIO()
+        try:
+            if message.get('op') not in OPS:
+                raise ValueError('unknown op {}'.format(message.get('op')))
+            with contextlib.redirect_stdout(out):
+                result = getattr(self, 'op_' + message['op'])(message)
+        except Exception as e:
+            return {'ok': False, 'error': '{}: {}'.format(type(e).__name__, e), 'output': out.getvalue()}
+        return {'ok': True, 'result': result, 'output': out.getvalue()}
+
+    def op_ping(self, message):
+        return True
+
+    def op_sync(self, message):
+        # the todolist.py run in process (e.g. --compact) may have handed out hex ids
+        config.HEX_START = self.store.get_hex_start()
+        sync(self.store, self.path2modtime, self.path2fingerprint)
+        return True
+
+    def op_schedule(self, message):
+        """
+        the todos to work on within message['budget_minutes'], as
+        (text, hex, date ordinal, minutes, priority) rows.
+        """
+        feasible_set = schedule(self.current_todos(), message['budget_minutes'],
+                message.get('mode', 'knapsack'), message.get('decay', 'linear'))
+        return [(todo.text, todo.hex, todo.assign_ordinal, todo.minutes, todo.priority) for todo in feasible_set]
+
+    def op_search(self, message):
+        """
+        the unchecked todos containing all of message['terms'], as snapshot rows.
+        """
+        return snapshot_rows(search_records(self.store, message['terms']))
+
+    def op_checkoff(self, message):
+        writer = CheckOffWriter()
+        for todo in message['todos']:
+            writer.add(todo)
+        flushed = writer.flush()
+        refresh_snapshot(self.store.data_dir)
+        return flushed
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            reply = self.server.todo_server.handle(json.loads(line.decode('utf-8')))
+            self.wfile.write((json.dumps(reply) + '\n').encode('utf-8'))
+
+def stop(signum, frame):
+    raise KeyboardInterrupt
+
+def serve(data_dir=DATA_DIR):
+    """
+    serves requests one at a time until interrupted.
+    """
+    path = socket_path(data_dir)
+    if request({'op': 'ping'}, path) is not None:
+        print('a server is already running on {}'.format(path))
+        return
+    if os.path.exists(path):
+        os.remove(path) # left over by a server that is gone
+    todo_server = TodoServer(data_dir)
+    server = socketserver.UnixStreamServer(path, RequestHandler)
+    server.todo_server = todo_server
+    # stopping it with kill cleans up like Ctrl-C does
+    signal.signal(signal.SIGTERM, stop)
+    print('serving on {}, Ctrl-C to stop'.format(path))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print('stopped serving')
+    finally:
+        server.server_close()
+        os.remove(path)
+        todo_server.store.close()
+
+if __name__ == '__main__':
+    serve()
@@ -0,0 +1,42 @@
+"""
+Settings of its own for code that works on the notes and todolists of a
+directory without going through the config module and the working directory,
+like todostore.py.
+
+The functions that read settings take an optional settings argument: None for
+the config module, with the paths relative to the working directory, or a
+Settings, with the paths relative to its root. The paths of the notes and
+todolists are kept relative either way (they are written in the todolists and
+the index store), and located() gives the path to open them at.
+"""
+import os
+import copy
+import config
+
+# the settings of config.py
+NAMES = [name for name in dir(config) if name.isupper()]
+
+class Settings(object):
+    """
+    a copy of the settings of config.py, with the ones given overridden, for
+    the notes and todolists under root. Changing one doesn't change the
+    other.
+    """
+    def __init__(self, root, **overrides):
+        for name in overrides:
+            assert name in NAMES, 'unknown setting {}'.format(name)
+        self.root = os.path.abspath(os.path.expanduser(root))
+        for name in NAMES:
+            setattr(self, name, copy.deepcopy(overrides[name] if name in overrides else getattr(config, name)))
+
+def current(settings=None):
+    """
+    the settings to read: settings, or the config module when None.
+    """
+    return config if settings is None else settings
+
+def located(path, settings=None):
+    """
+    the path to open the file at path, given relative to the root of settings.
+    """
+    return path if settings is None else os.path.join(settings.root, path)
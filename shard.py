@@ -0,0 +1,66 @@
+"""
+Process pool versions of the phases of a sync that work on each note on its
+own: finding the new todos of the notes, and writing their hex tags into them.
+
+The hex ids are handed out in the parent, as one block per note in the order
+of the notes, so a sharded sync writes the same todolist and tags as a
+sequential one.
+"""
+import io
+import sys
+import contextlib
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from utils import parse_new_unchecked_todos, write_hashes_on_new_todos, format_hex
+from settings import current
+
+def chunk_size(items, jobs):
+    # a few chunks per worker, to even out notes of different sizes
+    return max(1, len(items) // (jobs * 4))
+
+def parse_note(note, settings=None):
+    """
+    runs in a worker: the new todos of a note, and what parsing it printed.
+    """
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        todos = parse_new_unchecked_todos(note, settings)
+    return todos, out.getvalue()
+
+def tag_note(note_todos, settings=None):
+    """
+    runs in a worker: writes the hex tags of the new todos of a note.
+    """
+    note, todos_w_hashes = note_todos
+    write_hashes_on_new_todos({note: todos_w_hashes}, settings)
+
+def get_new_unchecked_todos_sharded(notes, jobs, settings=None):
+    """
+    same as calling get_new_unchecked_todos on each of notes in turn, with the
+    notes parsed by `jobs` processes. Returns a dictionary of note -> list of
+    (todo, hex, line number, end offset), in the order of notes.
+    """
+    conf = current(settings)
+    note2newtodos_w_hashes = {}
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        results = pool.map(partial(parse_note, settings=settings), notes, chunksize=chunk_size(notes, jobs))
+        for note, (todos, output) in zip(notes, results):
+            print('examining {}'.format(note))
+            sys.stdout.write(output)
+            # reserve a block of hex ids for the note
+            hex_start = conf.HEX_START
+            conf.HEX_START += len(todos)
+            note2newtodos_w_hashes[note] = [(todo, format_hex(hex_start + idx, settings), l_nb, end) \
+                    for idx, (todo, l_nb, end) in enumerate(todos)]
+    return note2newtodos_w_hashes
+
+def write_hashes_on_new_todos_sharded(note2newtodos_w_hashes, jobs, settings=None):
+    """
+    same as write_hashes_on_new_todos, with the notes written by `jobs`
+    processes.
+    """
+    note_todos = [(note, note2newtodos_w_hashes[note]) for note in note2newtodos_w_hashes \
+            if len(note2newtodos_w_hashes[note])]
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        # list() so that errors in the workers are raised here
+        list(pool.map(partial(tag_note, settings=settings), note_todos, chunksize=chunk_size(note_todos, jobs)))
@@ -0,0 +1,97 @@
+"""
+Snapshot of the unchecked todos of the todolist, so that todofetcher.py can
+answer without parsing the todolist.
+
+It is rewritten at the end of every sync, and is only used while the todolist
+still has the size and modification time it was written for. With partitioned
+todolists, the snapshot holds an entry for each of them, and each entry is
+only used while its own todolist is unchanged. Reading it only needs marshal,
+so the heavier modules are imported when writing it.
+"""
+import os
+import marshal
+from settings import current, located
+
+# same directory as store.DATA_DIR, which isn't imported to keep sqlite out of
+# the start up of todofetcher.py
+DATA_DIR = '.data/'
+SNAPSHOT_NAME = 'unchecked.snapshot'
+SNAPSHOT_VERSION = 2
+
+def snapshot_path(data_dir=DATA_DIR):
+    return os.path.join(data_dir, SNAPSHOT_NAME)
+
+def todolist_signature(fpath, settings=None):
+    """
+    (size, mtime_ns) of the todolist, like utils.note_signature.
+    """
+    st = os.stat(located(fpath, settings))
+    return (st.st_size, st.st_mtime_ns)
+
+def snapshot_rows(records):
+    """
+    a (text, hex, date ordinal, minutes) tuple for each unchecked TodoRecord.
+    The date and minutes are None when the todo has none.
+    """
+    return [(record.text, record.hex,
+             None if record.date is None else record.date.toordinal(),
+             None if record.duration is None else int(record.duration.total_seconds() // 60)) \
+            for record in records if not record.checked]
+
+def read_snapshot(data_dir=DATA_DIR):
+    """
+    returns the entries of the snapshot, a dictionary of the absolute path of
+    a todolist -> (signature, rows), or an empty one if there is no snapshot.
+    """
+    try:
+        with open(snapshot_path(data_dir), 'rb') as f:
+            version, entries = marshal.load(f)
+        if version != SNAPSHOT_VERSION:
+            return {}
+    except (OSError, EOFError, ValueError, TypeError):
+        return {}
+    return entries
+
+def write_snapshot(records, fpath=None, data_dir=DATA_DIR, settings=None):
+    """
+    writes the snapshot of the unchecked todos among records, which should
+    hold every todo of the todolist at fpath as it is now. The entries of the
+    other todolists are kept.
+    """
+    fpath = current(settings).TODOLIST_NAME if fpath is None else fpath
+    write_snapshots({fpath: records}, data_dir, settings)
+
+def write_snapshots(fpath2records, data_dir=DATA_DIR, settings=None):
+    """
+    same as write_snapshot for several todolists at once, given a dictionary
+    of todolist path -> records.
+    """
+    from utils import atomic_write_chunks
+    entries = read_snapshot(data_dir)
+    # entries of todolists that are gone
+    for path in [path for path in entries if not os.path.exists(path)]:
+        del entries[path]
+    for fpath in fpath2records:
+        entries[os.path.abspath(located(fpath, settings))] = (todolist_signature(fpath, settings),
+                snapshot_rows(fpath2records[fpath]))
+    data = marshal.dumps((SNAPSHOT_VERSION, entries))
+    if not os.path.exists(data_dir):
+        os.makedirs(data_dir)
+    atomic_write_chunks(snapshot_path(data_dir), [data])
+
+def load_snapshot(fpath=None, data_dir=DATA_DIR, entries=None, settings=None):
+    """
+    returns the rows of the snapshot of the todolist at fpath, or None if
+    there is no snapshot or the todolist changed since it was written.
+    entries are the ones returned by read_snapshot, to read it only once for
+    several todolists.
+    """
+    fpath = current(settings).TODOLIST_NAME if fpath is None else fpath
+    entries = read_snapshot(data_dir) if entries is None else entries
+    entry = entries.get(os.path.abspath(located(fpath, settings)))
+    try:
+        if entry is None or tuple(entry[0]) != todolist_signature(fpath, settings):
+            return None
+    except OSError:
+        return None
+    return entry[1]
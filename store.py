@@ -0,0 +1,361 @@
+"""
+Persistent index of the sync state, kept in a single sqlite database that
+replaces the .data/*.pkl files.
+"""
+import os
+import json
+import pickle
+import sqlite3
+from datetime import datetime
+from settings import located
+
+DATA_DIR = '.data/'
+DB_NAME = 'index.db'
+# sqlite limits the number of host parameters in a single statement
+QUERY_CHUNK = 500
+
+# SCHEMA[i] upgrades the database from version i to version i+1
+SCHEMA = [
+    [
+        'CREATE TABLE meta (key TEXT PRIMARY KEY, value)',
+        'CREATE TABLE todos (hex TEXT PRIMARY KEY, path TEXT, completed INTEGER NOT NULL DEFAULT 0)',
+        'CREATE INDEX todos_path ON todos (path)',
+        'CREATE TABLE notes (path TEXT PRIMARY KEY, modtime REAL NOT NULL)',
+    ],
+    [
+        'CREATE TABLE note_index (path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL)',
+        'CREATE TABLE hex_offsets (hex TEXT PRIMARY KEY, path TEXT NOT NULL, offset INTEGER NOT NULL)',
+        'CREATE INDEX hex_offsets_path ON hex_offsets (path)',
+    ],
+    [
+        'CREATE TABLE docs (id INTEGER PRIMARY KEY, hex TEXT, text TEXT NOT NULL, assign_date INTEGER, minutes INTEGER)',
+        'CREATE TABLE doc_tokens (token TEXT NOT NULL, doc INTEGER NOT NULL, PRIMARY KEY (token, doc)) WITHOUT ROWID',
+        'CREATE INDEX doc_tokens_doc ON doc_tokens (doc)',
+        'CREATE TABLE doc_trigrams (gram TEXT NOT NULL, doc INTEGER NOT NULL, PRIMARY KEY (gram, doc)) WITHOUT ROWID',
+        'CREATE INDEX doc_trigrams_doc ON doc_trigrams (doc)',
+    ],
+    [
+        'ALTER TABLE notes ADD COLUMN size INTEGER',
+        'ALTER TABLE notes ADD COLUMN digest TEXT',
+    ],
+    [
+        'CREATE TABLE archived_todos (hex TEXT PRIMARY KEY, path TEXT, archive TEXT NOT NULL)',
+        'CREATE INDEX archived_todos_path ON archived_todos (path)',
+    ],
+    [
+        'CREATE TABLE dir_manifest (path TEXT PRIMARY KEY, mtime_ns INTEGER, subdirs TEXT NOT NULL, notes TEXT NOT NULL)',
+    ],
+]
+
+def chunks(l, n=QUERY_CHUNK):
+    """
+    yields successive slices of l of length at most n.
+    """
+    for i in range(0, len(l), n):
+        yield l[i:i+n]
+
+class IndexStore(object):
+    """
+    Keyed by hex id (todo -> note path, completion) and by note path
+    (note -> modification time). Every write happens inside a transaction,
+    so a crash never leaves the tables out of step with each other. The note
+    paths are relative to the root of settings (see settings.py).
+    """
+    def __init__(self, data_dir=DATA_DIR, settings=None):
+        if not os.path.exists(data_dir):
+            os.makedirs(data_dir)
+        self.data_dir = data_dir
+        self.settings = settings
+        self.conn = sqlite3.connect(os.path.join(data_dir, DB_NAME))
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.upgrade_schema()
+        self.migrate_pickles()
+
+    def upgrade_schema(self):
+        """
+        brings the database up to the latest version in SCHEMA.
+        """
+        version = self.conn.execute('PRAGMA user_version').fetchone()[0]
+        with self.conn:
+            for statements in SCHEMA[version:]:
+                for statement in statements:
+                    self.conn.execute(statement)
+            self.conn.execute('PRAGMA user_version = {}'.format(len(SCHEMA)))
+
+    def migrate_pickles(self):
+        """
+        one-time import of mem.pkl, hash2completion.pkl, hash2path.pkl and
+        path2modtime.pkl, if they exist from an older version.
+        """
+        if self.get_meta('pickles_migrated'):
+            return
+        loaded = {}
+        for name in ['mem', 'hash2completion', 'hash2path', 'path2modtime']:
+            pkl_path = os.path.join(self.data_dir, name + '.pkl')
+            if os.path.exists(pkl_path):
+                with open(pkl_path, 'rb') as f:
+                    loaded[name] = pickle.load(f)
+            else:
+                loaded[name] = {}
+
+        with self.transaction():
+            if 'HEX_START' in loaded['mem']:
+                self.set_hex_start(loaded['mem']['HEX_START'])
+            self.add_todos(loaded['hash2path'])
+            self.conn.executemany('INSERT OR IGNORE INTO todos (hex, path) VALUES (?, NULL)',
+                    [(hex_id,) for hex_id in loaded['hash2completion']])
+            self.mark_completed([hex_id for hex_id in loaded['hash2completion'] \
+                    if loaded['hash2completion'][hex_id]])
+            self.set_modtimes(loaded['path2modtime'])
+            self.set_meta('pickles_migrated', 1)
+        if len(loaded['mem']) or len(loaded['hash2path']):
+            print('migrated pickled state into {}'.format(DB_NAME))
+
+    def transaction(self):
+        """
+        context manager that commits everything written inside it at once, or
+        nothing at all if an exception is raised.
+        """
+        return self.conn
+
+    def close(self):
+        self.conn.close()
+
+    def get_meta(self, key, default=None):
+        row = self.conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return default if row is None else row[0]
+
+    def set_meta(self, key, value):
+        self.conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
+
+    def get_hex_start(self):
+        return self.get_meta('HEX_START', 0)
+
+    def set_hex_start(self, hex_start):
+        self.set_meta('HEX_START', hex_start)
+
+    def get_completion(self, hex_id):
+        """
+        returns whether the todo with hex_id has been completed, or None if
+        the hex_id is unknown. Archived todos are completed.
+        """
+        row = self.conn.execute('SELECT completed FROM todos WHERE hex = ?', (hex_id,)).fetchone()
+        if row is None:
+            row = self.conn.execute('SELECT 1 FROM archived_todos WHERE hex = ?', (hex_id,)).fetchone()
+        return None if row is None else bool(row[0])
+
+    def get_path(self, hex_id):
+        row = self.conn.execute('SELECT path FROM todos WHERE hex = ?', (hex_id,)).fetchone()
+        if row is None:
+            row = self.conn.execute('SELECT path FROM archived_todos WHERE hex = ?', (hex_id,)).fetchone()
+        return None if row is None else row[0]
+
+    def get_archive(self, hex_id):
+        """
+        returns the archive file an archived todo was moved to, or None.
+        """
+        row = self.conn.execute('SELECT archive FROM archived_todos WHERE hex = ?', (hex_id,)).fetchone()
+        return None if row is None else row[0]
+
+    def get_uncompleted_paths(self, hex_ids):
+        """
+        for the hex ids in hex_ids that are known but not yet completed, returns
+        a dictionary of hex id -> note path.
+        """
+        hex2path = {}
+        for chunk in chunks(list(hex_ids)):
+            rows = self.conn.execute('SELECT hex, path FROM todos WHERE completed = 0 AND hex IN ({})'\
+                    .format(','.join('?'*len(chunk))), chunk)
+            hex2path.update(rows)
+        return hex2path
+
+    def add_todos(self, hex2path):
+        """
+        records new todos (hex id -> note path) as not completed.
+        """
+        self.conn.executemany('INSERT OR REPLACE INTO todos (hex, path, completed) VALUES (?, ?, 0)',
+                list(hex2path.items()))
+
+    def mark_completed(self, hex_ids):
+        self.conn.executemany('UPDATE todos SET completed = 1 WHERE hex = ?',
+                [(hex_id,) for hex_id in hex_ids])
+
+    def get_todos(self):
+        """
+        returns a dictionary of hex id -> (note path, completed) of every todo
+        that isn't archived.
+        """
+        return {hex_id: (path, bool(completed)) for hex_id, path, completed in \
+                self.conn.execute('SELECT hex, path, completed FROM todos')}
+
+    def get_archived_paths(self):
+        """
+        returns a dictionary of hex id -> note path of the archived todos.
+        """
+        return dict(self.conn.execute('SELECT hex, path FROM archived_todos'))
+
+    def relocate_todos(self, hex2state):
+        """
+        sets the note path and completion (hex id -> (path, completed)) of
+        todos as they were found in the notes, adding the ones that are
+        unknown. Archived todos only get their path updated.
+        """
+        archived = [hex_id for hex_id in self.get_archived_paths() if hex_id in hex2state]
+        self.conn.executemany('UPDATE archived_todos SET path = ? WHERE hex = ?',
+                [(hex2state[hex_id][0], hex_id) for hex_id in archived])
+        archived = set(archived)
+        self.conn.executemany('INSERT OR REPLACE INTO todos (hex, path, completed) VALUES (?, ?, ?)',
+                [(hex_id, hex2state[hex_id][0], int(hex2state[hex_id][1])) \
+                        for hex_id in hex2state if hex_id not in archived])
+
+    def archive_todos(self, hex_ids, archive):
+        """
+        moves the completed todos among hex_ids out of the todos table, keeping
+        their note path along with the archive file their section went to.
+        Returns the number of todos moved.
+        """
+        moved = 0
+        for chunk in chunks(list(hex_ids)):
+            where = 'completed = 1 AND hex IN ({})'.format(','.join('?'*len(chunk)))
+            self.conn.execute('INSERT OR REPLACE INTO archived_todos (hex, path, archive) '\
+                    'SELECT hex, path, ? FROM todos WHERE ' + where, [archive] + chunk)
+            moved += self.conn.execute('DELETE FROM todos WHERE ' + where, chunk).rowcount
+        return moved
+
+    def get_header_offsets(self, fpath):
+        """
+        returns the byte offsets of the headers of the todolist at fpath, as
+        last returned by write_to_todo, or None.
+        """
+        value = self.get_meta('todo_headers:' + fpath)
+        return None if value is None else json.loads(value)
+
+    def set_header_offsets(self, fpath, offsets):
+        self.set_meta('todo_headers:' + fpath, json.dumps(offsets))
+
+    def get_modtimes(self):
+        """
+        returns a dictionary of note path -> modification date (datetime)
+        """
+        return {path: datetime.fromtimestamp(modtime) for path, modtime in \
+                self.conn.execute('SELECT path, modtime FROM notes')}
+
+    def set_modtimes(self, path2modtime):
+        self.conn.executemany('INSERT OR REPLACE INTO notes (path, modtime) VALUES (?, ?)',
+                [(path, path2modtime[path].timestamp()) for path in path2modtime])
+
+    def get_fingerprints(self):
+        """
+        returns a dictionary of note path -> (size, content digest)
+        """
+        return {row[0]: (row[1], row[2]) for row in \
+                self.conn.execute('SELECT path, size, digest FROM notes WHERE digest IS NOT NULL')}
+
+    def set_fingerprints(self, path2fingerprint):
+        """
+        records the (size, content digest) of notes already in the notes table.
+        """
+        self.conn.executemany('UPDATE notes SET size = ?, digest = ? WHERE path = ?',
+                [(path2fingerprint[path][0], path2fingerprint[path][1], path) for path in path2fingerprint])
+
+    def get_dir_manifest(self, key):
+        """
+        returns a dictionary of directory path -> (mtime_ns, subdirectory
+        paths, note names) for scanner.DirManifest, or None if it was listed
+        with other settings than key.
+        """
+        if self.get_meta('dir_manifest_key') != key:
+            return None
+        return {path: (mtime_ns, json.loads(subdirs), json.loads(notes)) for path, mtime_ns, subdirs, notes in \
+                self.conn.execute('SELECT path, mtime_ns, subdirs, notes FROM dir_manifest')}
+
+    def save_dir_manifest(self, manifest, key):
+        """
+        writes the entries of a scanner.DirManifest listed with the settings of
+        key that changed since it was loaded, and drops the ones it removed.
+        """
+        if self.get_meta('dir_manifest_key') != key:
+            self.conn.execute('DELETE FROM dir_manifest')
+            self.set_meta('dir_manifest_key', key)
+        self.conn.executemany('INSERT OR REPLACE INTO dir_manifest (path, mtime_ns, subdirs, notes) VALUES (?, ?, ?, ?)',
+                [(d, manifest.entries[d][0], json.dumps(manifest.entries[d][1]), json.dumps(manifest.entries[d][2])) \
+                        for d in manifest.dirty])
+        self.conn.executemany('DELETE FROM dir_manifest WHERE path = ?', [(d,) for d in manifest.removed])
+        manifest.dirty = set()
+        manifest.removed = set()
+
+    def forget_notes(self, paths):
+        """
+        drops notes that no longer exist. Their todos keep the path they were
+        last seen at.
+        """
+        for table in ['notes', 'note_index', 'hex_offsets']:
+            self.conn.executemany('DELETE FROM {} WHERE path = ?'.format(table), [(path,) for path in paths])
+
+    def move_note(self, old_path, new_path):
+        """
+        a note was moved or renamed: everything recorded for old_path now
+        belongs to new_path.
+        """
+        for table in ['todos', 'archived_todos', 'notes', 'note_index', 'hex_offsets']:
+            self.conn.execute('UPDATE {} SET path = ? WHERE path = ?'.format(table), (new_path, old_path))
+
+    def relink_todos(self, path, hex_ids):
+        """
+        points the todos with hex_ids, found in the note at path, to that note
+        when the note they were recorded in no longer exists. Returns the
+        number of todos relinked.
+        """
+        relinked = []
+        for chunk in chunks(list(hex_ids)):
+            rows = self.conn.execute('SELECT hex, path FROM todos WHERE hex IN ({})'\
+                    .format(','.join('?'*len(chunk))), chunk)
+            relinked.extend(hex_id for hex_id, old_path in rows if old_path != path \
+                    and (old_path is None or not os.path.exists(located(old_path, self.settings))))
+        self.conn.executemany('UPDATE todos SET path = ? WHERE hex = ?', [(path, hex_id) for hex_id in relinked])
+        return len(relinked)
+
+    def get_hex_offsets(self, path):
+        """
+        returns the index of hex id -> byte offset of its checklist marker for
+        the note at path, or None if the note has changed since it was indexed.
+        """
+        row = self.conn.execute('SELECT size, mtime_ns FROM note_index WHERE path = ?', (path,)).fetchone()
+        if row is None:
+            return None
+        try:
+            st = os.stat(located(path, self.settings))
+        except FileNotFoundError:
+            return None
+        if (st.st_size, st.st_mtime_ns) != row:
+            return None
+        return dict(self.conn.execute('SELECT hex, offset FROM hex_offsets WHERE path = ?', (path,)))
+
+    def set_hex_offsets(self, path, signature, hex2offset):
+        """
+        replaces the index of the note at path, built when the note had the
+        given (size, mtime_ns) signature.
+        """
+        self.conn.execute('DELETE FROM hex_offsets WHERE path = ?', (path,))
+        self.conn.executemany('INSERT OR REPLACE INTO hex_offsets (hex, path, offset) VALUES (?, ?, ?)',
+                [(hex_id, path, hex2offset[hex_id]) for hex_id in hex2offset])
+        self.set_note_signature(path, signature)
+
+    def set_all_hex_offsets(self, path2index):
+        """
+        same as set_hex_offsets for many notes at once, given a dictionary of
+        path -> (signature, hex2offset).
+        """
+        self.conn.executemany('DELETE FROM hex_offsets WHERE path = ?', [(path,) for path in path2index])
+        self.conn.executemany('INSERT OR REPLACE INTO hex_offsets (hex, path, offset) VALUES (?, ?, ?)',
+                [(hex_id, path, offset) for path in path2index for hex_id, offset in path2index[path][1].items()])
+        self.conn.executemany('INSERT OR REPLACE INTO note_index (path, size, mtime_ns) VALUES (?, ?, ?)',
+                [(path, path2index[path][0][0], path2index[path][0][1]) for path in path2index])
+
+    def set_note_signature(self, path, signature):
+        """
+        marks the index of the note at path as still valid for a new signature,
+        after an edit that didn't move any of the offsets.
+        """
+        self.conn.execute('INSERT OR REPLACE INTO note_index (path, size, mtime_ns) VALUES (?, ?, ?)',
+                (path, signature[0], signature[1]))
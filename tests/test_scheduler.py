@@ -0,0 +1,44 @@
+import random
+from itertools import combinations
+import pytest
+from scheduler import schedule_knapsack, DECAYS
+
+def brute_force(items, budget):
+    """
+    the best total priority of the items that fit in budget, and the most
+    minutes used at that total.
+    """
+    best = (0, 0)
+    for n in range(len(items) + 1):
+        for subset in combinations(items, n):
+            minutes = sum(item[1] for item in subset)
+            if minutes <= budget:
+                priority = sum(max(item[2], 0) for item in subset)
+                if priority > best[0] + 1e-9 or (abs(priority - best[0]) <= 1e-9 and minutes > best[1]):
+                    best = (priority, minutes)
+    return best
+
+def test_knapsack_float_priorities():
+    items = [(0, 60, 1.0), (1, 30, 1.104)]
+    assert schedule_knapsack(items, 60) == [items[1]]
+
+def test_knapsack_uses_the_most_time_among_ties():
+    items = [(0, 30, 2), (1, 60, 2)]
+    assert schedule_knapsack(items, 60) == [items[1]]
+
+@pytest.mark.parametrize('decay', sorted(DECAYS))
+def test_knapsack_is_optimal(decay):
+    rng = random.Random(0)
+    for _ in range(300):
+        items = [(idx, rng.choice([5, 10, 15, 20, 30, 45, 60, 90]), DECAYS[decay](rng.randint(0, 10))) \
+                for idx in range(rng.randint(1, 8))]
+        budget = rng.randint(0, 180)
+        picked = schedule_knapsack(items, budget)
+        assert len(set(item[0] for item in picked)) == len(picked)
+        priority, minutes = brute_force(items, budget)
+        assert sum(item[1] for item in picked) == minutes
+        assert sum(item[2] for item in picked) == pytest.approx(priority)
+
+def test_knapsack_picks_everything_that_fits():
+    items = [(idx, 5 + idx % 7, idx % 3) for idx in range(2000)]
+    assert schedule_knapsack(items, sum(item[1] for item in items)) == items
@@ -0,0 +1,95 @@
+import os
+import time
+import pytest
+import config
+from store import IndexStore
+from todolist import sync
+
+@pytest.fixture
+def notes(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(config, 'NOTES_DIRS', ['notes'])
+    monkeypatch.setattr(config, 'HEX_START', 0)
+    os.makedirs('notes')
+    with open(config.TODOLIST_NAME, 'w') as f:
+        f.write('#TODO\n')
+    store = IndexStore()
+    yield store
+    store.close()
+
+def run_sync(store):
+    sync(store, store.get_modtimes(), store.get_fingerprints())
+
+def edit(fpath, old, new):
+    with open(fpath) as f:
+        text = f.read()
+    assert old in text
+    # a later modification time, for filesystems with coarse timestamps
+    time.sleep(0.01)
+    with open(fpath, 'w') as f:
+        f.write(text.replace(old, new))
+
+# the boxes are patched in place with markers of the same length, and the
+# note is rewritten line by line otherwise
+@pytest.mark.parametrize('checked_marker', ['- [x]', '- [done]'])
+def test_new_todo_below_check_off(notes, monkeypatch, checked_marker):
+    monkeypatch.setattr(config, 'CHECKLIST_UNCHECKED_MARKERS', ['- [ ]'])
+    monkeypatch.setattr(config, 'CHECKLIST_CHECKED_MARKERS', [checked_marker])
+    note = os.path.join('notes', 'a.md')
+    with open(note, 'w') as f:
+        f.write('# a\n- [ ] first, 10 m\n')
+    run_sync(notes)
+
+    # checked off in the todolist, and a new todo below it in the same note
+    edit(config.TODOLIST_NAME, '- [ ] first', checked_marker + ' first')
+    edit(note, '- [ ] first, 10 m {0x00000000}\n', '- [ ] first, 10 m {0x00000000}\n- [ ] newer, 5 m\n')
+    run_sync(notes)
+
+    with open(note) as f:
+        assert f.read() == '# a\n' + checked_marker + ' first, 10 m {0x00000000}\n- [ ] newer, 5 m {0x00000001}\n'
+
+def test_hex_ids_reserved_before_tagging(notes, monkeypatch):
+    import todolist
+    def crash(note2newtodos_w_hashes, settings=None):
+        raise KeyboardInterrupt
+    monkeypatch.setattr(todolist, 'write_hashes_on_new_todos', crash)
+    with open(os.path.join('notes', 'a.md'), 'w') as f:
+        f.write('* [ ] first, 10 m\n* [ ] second, 5 m\n')
+    with pytest.raises(KeyboardInterrupt):
+        run_sync(notes)
+    assert notes.get_hex_start() == 2
+
+def test_excluded_notes_are_left_out_of_every_scan(notes, monkeypatch):
+    from scanner import scan_paths
+    monkeypatch.setattr(config, 'SCAN_EXCLUDE', ['attachments'])
+    monkeypatch.setattr(config, 'MAX_NOTE_SIZE', 100)
+    os.makedirs(os.path.join('notes', 'attachments', 'sub'))
+    paths = [os.path.join('notes', 'attachments', 'sub', 'x.md'), os.path.join('notes', 'big.md'),
+            os.path.join('notes', '.#lock.md')]
+    for path in paths:
+        with open(path, 'w') as f:
+            f.write('* [ ] skipped, 5 m\n' * (10 if 'big' in path else 1))
+    run_sync(notes)
+    store_state = (notes.get_modtimes(), notes.get_todos())
+    # the same notes given by path, like the watcher and TodoStore.sync do
+    assert scan_paths(paths, {}) == ([], set())
+    sync(notes, notes.get_modtimes(), notes.get_fingerprints(), paths)
+    assert (notes.get_modtimes(), notes.get_todos()) == store_state == ({}, {})
+    for path in paths:
+        with open(path) as f:
+            assert '{0x' not in f.read()
+
+def test_watcher_skips_excluded_directories(notes, monkeypatch):
+    watch = pytest.importorskip('watch')
+    monkeypatch.setattr(config, 'SCAN_EXCLUDE', ['attachments'])
+    os.makedirs(os.path.join('notes', 'attachments'))
+    os.makedirs(os.path.join('notes', 'kept'))
+    for path in [os.path.join('notes', 'attachments', 'x.md'), os.path.join('notes', 'kept', 'y.md')]:
+        with open(path, 'w') as f:
+            f.write('* [ ] todo, 5 m\n')
+    try:
+        watcher = watch.InotifyWatcher([], [])
+    except (OSError, AttributeError):
+        pytest.skip('inotify is not available')
+    assert watcher.add_tree('notes') == set([os.path.join('notes', 'kept', 'y.md')])
+    assert sorted(watcher.wd2dir.values()) == ['notes', os.path.join('notes', 'kept')]
@@ -0,0 +1,60 @@
+import os
+import pytest
+import config
+import utils
+from settings import NAMES
+from todostore import TodoStore
+
+@pytest.fixture
+def root(tmp_path, monkeypatch):
+    # the process works somewhere else than the notes of the store
+    os.makedirs(str(tmp_path / 'elsewhere'))
+    monkeypatch.chdir(tmp_path / 'elsewhere')
+    for notes_dir in ['travis', 'hack']:
+        os.makedirs(str(tmp_path / 'root' / notes_dir))
+    with open(str(tmp_path / 'root' / 'todo.md'), 'w') as f:
+        f.write('#TODO\n')
+    return tmp_path / 'root'
+
+def write(fpath, text):
+    with open(str(fpath), 'w') as f:
+        f.write(text)
+
+def test_settings_stay_in_the_store(root):
+    config_before = {name: repr(getattr(config, name)) for name in NAMES}
+    cwd = os.getcwd()
+    write(root / 'travis' / 'a.md', '- [ ] read the paper, 20 m\n')
+    with TodoStore(str(root), NOTES_DIRS=['travis'], TODOLIST_NAME='todo.md',
+            CHECKLIST_UNCHECKED_MARKERS=['- [ ]'], CHECKLIST_CHECKED_MARKERS=['- [x]']) as todos:
+        todos.sync()
+        records = list(todos.unchecked())
+        assert [record.text for record in records] == ['- [ ] read the paper, 20 m {0x00000000} (in `travis/a.md`)']
+        assert list(todos.by_note('travis/a.md')) == records
+        assert todos.check_off(records)
+        todos.sync()
+        assert list(todos.unchecked()) == []
+        assert todos.lookup(0) == ('0x00000000', 'travis/a.md', True, None)
+    with open(str(root / 'travis' / 'a.md')) as f:
+        assert f.read() == '- [x] read the paper, 20 m {0x00000000}\n'
+    assert os.getcwd() == cwd and os.listdir(cwd) == []
+    assert {name: repr(getattr(config, name)) for name in NAMES} == config_before
+
+def test_unchecked_reads_the_todolists_as_it_goes(root, monkeypatch):
+    write(root / 'travis' / 'a.md', '* [ ] first, 10 m\n')
+    write(root / 'hack' / 'b.md', '* [ ] second, 10 m\n')
+    todos = TodoStore(str(root), NOTES_DIRS=['travis', 'hack'], PARTITION_TODOLISTS=True)
+    todos.sync()
+    # the second partition changes after the snapshot was written
+    with open(str(root / 'todo_partitions' / 'hack.md'), 'a') as f:
+        f.write('* [ ] third, 10 m\n')
+    parsed = []
+    iter_todolist = utils.iter_todolist
+    def counted(fpath=None, settings=None):
+        parsed.append(fpath)
+        return iter_todolist(fpath, settings)
+    monkeypatch.setattr(utils, 'iter_todolist', counted)
+    unchecked = todos.unchecked()
+    assert next(unchecked).text.startswith('* [ ] first')
+    assert parsed == []
+    assert [record.text.split(',')[0] for record in unchecked] == ['* [ ] second', '* [ ] third']
+    assert parsed == [os.path.join('todo_partitions', 'hack.md')]
@@ -0,0 +1,38 @@
+import pytest
+import profiling
+import utils
+
+@pytest.fixture
+def counters(monkeypatch):
+    monkeypatch.setattr(profiling, 'ENABLED', True)
+    monkeypatch.setattr(profiling, 'counters', {})
+    return profiling.counters
+
+def write_on(monkeypatch, fpath, ds, todo, hex_id, offsets):
+    monkeypatch.setattr(utils, 'get_date_string', lambda: ds)
+    return utils.write_to_todo({'notes/a.md': [(todo, hex_id, 0, 0)]}, offsets, fpath)
+
+def test_write_to_todo_uses_cached_headers(tmp_path, monkeypatch, counters):
+    fpath = str(tmp_path / 'todo.md')
+    with open(fpath, 'w') as f:
+        f.write('#TODO\n1/2/20\n* [ ] old, 10 m\n')
+    offsets = write_on(monkeypatch, fpath, '10/18/26', '* [ ] a, 5 m', '0x00000000', None)
+    assert counters.get('todo_header_scans') == 1
+    # the first write of the next day, and a second one on that day
+    offsets = write_on(monkeypatch, fpath, '10/19/26', '* [ ] b, 5 m', '0x00000001', offsets)
+    offsets = write_on(monkeypatch, fpath, '10/19/26', '* [ ] c, 5 m', '0x00000002', offsets)
+    assert counters.get('todo_header_scans') == 1
+    with open(fpath) as f:
+        assert f.read() == '#TODO\n10/19/26\n* [ ] c, 5 m {0x00000002} (in `notes/a.md`)\n' \
+                '* [ ] b, 5 m {0x00000001} (in `notes/a.md`)\n\n' \
+                '10/18/26\n* [ ] a, 5 m {0x00000000} (in `notes/a.md`)\n\n1/2/20\n* [ ] old, 10 m\n'
+
+def test_write_to_todo_finds_todays_header_after_todo(tmp_path, monkeypatch, counters):
+    # today's header was written without the cache knowing about it
+    fpath = str(tmp_path / 'todo.md')
+    with open(fpath, 'w') as f:
+        f.write('#TODO\n\n10/19/26\n* [ ] b, 5 m\n')
+    write_on(monkeypatch, fpath, '10/19/26', '* [ ] c, 5 m', '0x00000002', {'#TODO': 0})
+    assert 'todo_header_scans' not in counters
+    with open(fpath) as f:
+        assert f.read() == '#TODO\n\n10/19/26\n* [ ] c, 5 m {0x00000002} (in `notes/a.md`)\n* [ ] b, 5 m\n'
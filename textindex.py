@@ -0,0 +1,178 @@
+"""
+Token and trigram index over the text of the unchecked todos, kept in the
+sqlite store, for the -s and -k lookups.
+"""
+import re
+from datetime import datetime, timedelta
+from store import chunks
+from utils import TodoRecord, note_signature
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+def tokenize(text):
+    """
+    returns the set of lowercase word tokens in text
+    """
+    return set(TOKEN_PATTERN.findall(text.lower()))
+
+def trigrams(text):
+    """
+    returns the set of 3-character substrings of text
+    """
+    return set(text[i:i+3] for i in range(len(text) - 2))
+
+def doc_key(record):
+    """
+    todos are identified by their hex id, or by their text when they don't
+    have one.
+    """
+    return record.hex if record.hex is not None else record.text
+
+def doc_state(record):
+    """
+    the (text, assign date ordinal, minutes) a todo is indexed with.
+    """
+    return (record.text, None if record.date is None else record.date.toordinal(),
+            None if record.duration is None else int(record.duration.total_seconds() // 60))
+
+def rank(text, terms):
+    """
+    scores a matching todo: every term counts once per occurrence, and twice
+    more when it is a whole word of the todo.
+    """
+    lowered = text.lower()
+    tokens = tokenize(text)
+    return sum([lowered.count(term) + (2 if term in tokens else 0) for term in terms])
+
+class TextIndex(object):
+    """
+    Posting lists from tokens and trigrams to the unchecked todos of a
+    todolist file, or of the partitions. The index remembers the (size,
+    mtime_ns) of the todolists it was last brought up to date with.
+    """
+    def __init__(self, store, fpaths):
+        self.store = store
+        self.conn = store.conn
+        # a todolist, or the partitions (see partitions.py) indexed together
+        self.fpaths = [fpaths] if isinstance(fpaths, str) else list(fpaths)
+        self.meta_key = 'text_index:' + ','.join(self.fpaths)
+
+    def signature(self):
+        return ';'.join(['%d:%d' % note_signature(fpath, self.store.settings) for fpath in self.fpaths])
+
+    def is_current(self):
+        try:
+            signature = self.signature()
+        except FileNotFoundError:
+            return False
+        return self.store.get_meta(self.meta_key) == signature
+
+    def mark_current(self):
+        self.store.set_meta(self.meta_key, self.signature())
+
+    def docs(self, records=None):
+        """
+        returns a dictionary of doc_key -> (doc id, (text, assign date, minutes))
+        of the indexed todos, or only of the ones with the keys of records.
+        """
+        query = 'SELECT id, hex, text, assign_date, minutes FROM docs'
+        if records is None:
+            rows = self.conn.execute(query)
+        else:
+            rows = []
+            hex_ids = sorted(set(record.hex for record in records if record.hex is not None))
+            texts = sorted(set(record.text for record in records if record.hex is None))
+            for column, keys in [('hex', hex_ids), ('text', texts)]:
+                for chunk in chunks(keys):
+                    rows.extend(self.conn.execute(query + ' WHERE {} IN ({})'.format(column, ','.join('?'*len(chunk))), chunk))
+        return {hex_id if hex_id is not None else text: (doc_id, (text, assign_date, minutes)) \
+                for doc_id, hex_id, text, assign_date, minutes in rows}
+
+    def update(self, records, partial=False):
+        """
+        brings the index in line with the unchecked records of the todolist,
+        adding, replacing and removing only the todos that changed. With
+        partial, records are only some of the todos, and no others are
+        removed. Should be called inside a transaction.
+        """
+        records = [record for record in records if not record.checked]
+        key2doc = self.docs(records if partial else None)
+        if not partial:
+            current_keys = set(doc_key(record) for record in records)
+            self.remove([key2doc[key][0] for key in key2doc if key not in current_keys])
+        seen = set()
+        for record in records:
+            key = doc_key(record)
+            if key in seen:
+                continue
+            seen.add(key)
+            if key in key2doc:
+                # a todo edited in the todolist keeps its hex id
+                if key2doc[key][1] == doc_state(record):
+                    continue
+                self.remove([key2doc[key][0]])
+            self.add(record)
+        self.mark_current()
+
+    def add(self, record):
+        cursor = self.conn.execute('INSERT INTO docs (hex, text, assign_date, minutes) VALUES (?, ?, ?, ?)',
+                (record.hex,) + doc_state(record))
+        doc_id = cursor.lastrowid
+        self.conn.executemany('INSERT INTO doc_tokens (token, doc) VALUES (?, ?)',
+                [(token, doc_id) for token in tokenize(record.text)])
+        self.conn.executemany('INSERT INTO doc_trigrams (gram, doc) VALUES (?, ?)',
+                [(gram, doc_id) for gram in trigrams(record.text.lower())])
+
+    def remove(self, doc_ids):
+        for table in ['doc_tokens', 'doc_trigrams']:
+            self.conn.executemany('DELETE FROM {} WHERE doc = ?'.format(table), [(doc_id,) for doc_id in doc_ids])
+        self.conn.executemany('DELETE FROM docs WHERE id = ?', [(doc_id,) for doc_id in doc_ids])
+
+    def candidates(self, terms):
+        """
+        returns the ids of the todos that contain every trigram of every term,
+        or None when the terms are too short to narrow anything down.
+        """
+        grams = set()
+        for term in terms:
+            grams |= trigrams(term)
+        if not len(grams):
+            return None
+        grams = list(grams)
+        doc_ids = None
+        for chunk in chunks(grams):
+            rows = self.conn.execute('SELECT doc FROM doc_trigrams WHERE gram IN ({}) GROUP BY doc HAVING COUNT(*) = ?'\
+                    .format(','.join('?'*len(chunk))), chunk + [len(chunk)])
+            found = set(row[0] for row in rows)
+            doc_ids = found if doc_ids is None else doc_ids & found
+            if not len(doc_ids):
+                break
+        return doc_ids
+
+    def search(self, terms):
+        """
+        returns a TodoRecord for every unchecked todo whose lowercased text
+        contains all of terms, best ranked first, then oldest first.
+        """
+        doc_ids = self.candidates(terms)
+        if doc_ids is None:
+            rows = self.conn.execute('SELECT id, hex, text, assign_date, minutes FROM docs')
+        else:
+            rows = []
+            for chunk in chunks(sorted(doc_ids)):
+                rows.extend(self.conn.execute('SELECT id, hex, text, assign_date, minutes FROM docs WHERE id IN ({})'\
+                        .format(','.join('?'*len(chunk))), chunk))
+        matches = []
+        for doc_id, hex_id, text, assign_date, minutes in rows:
+            if all([term in text.lower() for term in terms]):
+                matches.append((-rank(text, terms), assign_date or 0, doc_id,
+                    TodoRecord(text, False,
+                        None if assign_date is None else datetime.fromordinal(assign_date),
+                        hex_id, None if minutes is None else timedelta(minutes=minutes), None, None)))
+        return [match[-1] for match in sorted(matches, key=lambda match: match[:3])]
+
+    def search_substring(self, substring):
+        return self.search([substring])
+
+    def search_keywords(self, keywords):
+        return self.search(keywords)
@@ -1,144 +1,200 @@
 """
 Script for fetching for a todolist item
 """
+import os
 import sys
-from utils import * 
-import config
+from scheduler import Todo, SCHEDULERS, DECAYS, to_minutes, durationlist2datetime
+from snapshot import DATA_DIR, read_snapshot, load_snapshot, write_snapshot, snapshot_rows
+from partitions import todolist_paths
+from settings import current
+import profiling
 from datetime import datetime, timedelta
-from termcolor import colored 
-import time
-import argparse
-
-def get_priorities(todo2datedur):
-    today = datetime.now().date()
-    todo2priority= {}
-    for todo in todo2datedur:
-        diff = today - todo2datedur[todo]['assign_date'].date()
-        todo2priority[todo] = diff.days
-    
-    return todo2priority
-     
+import atexit
 
-def find_total_duration(l):
-    durations = [element['times']['duration'] for element in l]
-    sum_ = timedelta(minutes=0) 
-    for d in durations:
-        sum_ += d
+# utils, the index store, termcolor and the client of server.py are imported
+# where they are needed, so that a run answered from the snapshot starts in a
+# few milliseconds
 
-    return sum_
+# same as client.socket_path(), which isn't imported unless a server runs
+SOCKET_PATH = os.path.join(DATA_DIR, 'server.sock')
 
-def find_feasible_todos(duration, t2d):
-    
-    feasible_todos = [t for t in t2d if t2d[t]['duration']<= duration]
-    return feasible_todos             
-
-def pick_by_priority(todos, t2p):
-    # find the one with the max priority
-    max_prio = -1
-    best_todo = None
-    for t in todos: 
-        if max(t2p[t], 0) > max_prio:
-            max_prio = t2p[t]
-            best_todo = t
-    return best_todo
+# from this many todos on, they are scored as numpy arrays (see columnar.py)
+COLUMNAR_MIN_TODOS = 2000
 
-    
-def get_feasible_set(todo2datedur, todo2priority, budget_datetime):
-    todo2d = todo2datedur.copy() 
-    todo2p = todo2priority.copy()
-    
+def colored(text, color):
+    """
+    termcolor's colored, imported on first use.
+    """
+    from termcolor import colored as termcolor_colored
+    return termcolor_colored(text, color)
+
+def get_priorities(todos, decay='linear'):
+    """
+    sets the priority of every Todo from the number of days since it was
+    assigned, with the decay of that name, and returns them.
+    """
+    today = datetime.now().date().toordinal()
+    decay = DECAYS[decay]
+    for todo in todos:
+        todo.priority = decay(today - todo.assign_ordinal)
+    return todos
+
+def report_over_threshold(feasible_list):
+    print(colored('Found {} todos w/ priorities higher than threshold, total duration {}. Adding these to your list'.format(len(feasible_list), str(timedelta(minutes=sum([todo.minutes for todo in feasible_list])))), 'red'))
+
+def get_feasible_set(todos, budget_minutes, mode='knapsack', decay='linear', settings=None):
+    """
+    returns the list of Todos to work on within budget_minutes: every todo
+    with a priority above the threshold (PRIORITY_THRESHOLD days old, with
+    the same decay as the priorities), and then the ones picked by the
+    scheduler of `mode` for the time left.
+    """
     feasible_list = []
-    todo2d_new = {}
-    todo2p_new = {}
+    remaining_todos = []
+    threshold = DECAYS[decay](current(settings).PRIORITY_THRESHOLD)
     # in search of high priority above the threshold
-    for key in todo2d: 
-        assert key in todo2p 
-        priority = todo2p[key]
-        if priority > config.PRIORITY_THRESHOLD:
-            feasible_list.append({'todo_item':key,
-                                'times': todo2d[key],
-                                'priority': todo2p[key]} )
+    for todo in todos:
+        if todo.priority > threshold:
+            feasible_list.append(todo)
         else:
-            todo2d_new[key] = todo2d[key]
-            todo2p_new[key] = todo2p[key]
+            remaining_todos.append(todo)
 
-    todo2d = todo2d_new
-    todo2p = todo2p_new 
-    
-    total_duration = find_total_duration(feasible_list) 
-    if total_duration > budget_datetime:
-        print(colored('Found {} todos w/ priorities higher than threshold, total duration {}. Adding these to your list'.format(len(feasible_list), str(total_duration)), 'red'))
+    total_minutes = sum([todo.minutes for todo in feasible_list])
+    if total_minutes > budget_minutes:
+        report_over_threshold(feasible_list)
         return feasible_list
-    
+
     ## Selecting for remaining time
-    remaining_duration = budget_datetime - total_duration
-    
-    while True:
-        next_task_options = find_feasible_todos(remaining_duration, todo2d)
-        if len(next_task_options) == 0: 
-            break
-        next_task = pick_by_priority(next_task_options, todo2p)
-        
-        next_times = todo2d.pop(next_task)
-        feasible_list.append({'todo_item': next_task, 
-                            'times': next_times, 
-                            'priority': todo2p.pop(next_task)})
-        
-        total_duration += next_times ['duration'] 
-        remaining_duration -= next_times ['duration']
-    
-    return feasible_list 
-
-class CountDown(object):
-    def __init__(self, starting_time):
-        self.starting_time = starting_time
-        self.current_time = starting_time 
-        self.decrement_interval = 600
-        self.return_time = timedelta(seconds=0) 
-    
-    def start(self):
-        while self.current_time > self.return_time:
-            try:
-                # tic = time.time()
-                sys.stdout.write('\r{}'.format(colored(str(self.current_time), 'red')))
-                sys.stdout.flush()
-                time.sleep(1)
-                # toc = time.time()
-                self.current_time -= timedelta(seconds=1) 
-
-            except KeyboardInterrupt:
-                print("""
-Time out. 
-Options:
-1) Add more time [a]
-2) Check off item [c]
-3) Continue [n]
-4) Cancel [x]
-                """)
-                options = input()
-                if options.lower().strip() == 'a':
-                    print ("how much more time?")
-                    while True:
-                        try:
-                            time_str = input()
-                            extratime = duration2datetime(time_str)                
-                            self.current_time += extratime
-                            break 
-                        except:
-                            print('Invalid. Try again.')
-                elif options.lower().strip() == 'c':
-                    return {'status': 'complete',
-                            'remaining_time': self.current_time}
-                elif options.lower().strip() == 'n':
-                    pass 
-                elif options.lower().strip() == 'x':
-                    return {'status': 'term'}
-        
-        return {'status': 'out-of-time'}
+    items = [(todo, todo.minutes, todo.priority) for todo in remaining_todos]
+    for todo, _, _ in SCHEDULERS[mode](items, budget_minutes - total_minutes):
+        feasible_list.append(todo)
+
+    return feasible_list
+
+def schedule(todos, budget_minutes, mode='knapsack', decay='linear', settings=None):
+    """
+    get_priorities and then get_feasible_set, as numpy arrays when there are
+    many todos and numpy is installed.
+    """
+    if len(todos) >= COLUMNAR_MIN_TODOS:
+        try:
+            import columnar
+        except ImportError:
+            columnar = None
+        if columnar is not None:
+            with profiling.phase('columnar_schedule'):
+                feasible_set, over_budget = columnar.schedule(todos, budget_minutes, mode, decay,
+                        settings=settings)
+            if over_budget:
+                report_over_threshold(feasible_set)
+            return feasible_set
+    with profiling.phase('get_priorities'):
+        get_priorities(todos, decay)
+    with profiling.phase('get_feasible_set'):
+        return get_feasible_set(todos, budget_minutes, mode, decay, settings)
+
+def todos_from_rows(rows):
+    """
+    a Todo for each (text, hex, date ordinal, minutes) row of the snapshot,
+    where the duration is parsed once. Todos without a duration get the
+    default one for this run, and todos with the same text are one todo.
+    """
+    text2todo = {}
+    for text, hex_id, ordinal, minutes in rows:
+        assert ordinal is not None, "we have a rogue todolist item without a date"
+        if minutes is None:
+            from utils import add_placeholder_duration, parse_duration
+            print('{} does not have an interpretable duration, will be replacing with default for this run.'.format(text))
+            todo_default_time= add_placeholder_duration(text)                        
+            print('interpreted as: {}'.format(todo_default_time)) 
+            minutes = to_minutes(parse_duration(todo_default_time))
+        text2todo[text] = Todo(text, None if hex_id is None else int(hex_id, 16), ordinal, minutes)
+    return list(text2todo.values())
+
+def served_request(message):
+    """
+    the reply of server.py to message, or None when no server is running.
+    """
+    if not os.path.exists(SOCKET_PATH):
+        return None
+    from client import request
+    return request(message)
+
+def pop_option(args, flag, default):
+    """
+    removes `flag value` from the list of command line args if it's there,
+    and returns the value (or default).
+    """
+    if flag not in args:
+        return default
+    idx = args.index(flag)
+    if idx + 1 >= len(args):
+        raise ValueError('{} needs a value'.format(flag))
+    value = args[idx + 1]
+    del args[idx:idx + 2]
+    return value
+
+def iter_unchecked_rows(data_dir=DATA_DIR, settings=None):
+    """
+    yields the (text, hex, date ordinal, minutes) rows of the unchecked todos
+    of all the todolists, one todolist at a time. They come from the snapshot
+    written by the last sync, and only the todolists that changed since are
+    parsed.
+    """
+    with profiling.phase('load_snapshot'):
+        entries = read_snapshot(data_dir)
+    for fpath in todolist_paths(settings=settings):
+        fpath_rows = load_snapshot(fpath, data_dir, entries, settings)
+        if fpath_rows is None:
+            from utils import iter_todolist
+            with profiling.phase('parse_todolist'):
+                records = list(iter_todolist(fpath, settings))
+            with profiling.phase('write_snapshot'):
+                write_snapshot(records, fpath, data_dir, settings)
+            fpath_rows = snapshot_rows(records)
+        for row in fpath_rows:
+            yield row
+
+def load_todos(data_dir=DATA_DIR, settings=None):
+    """
+    the unchecked todos of all the todolists, as Todos.
+    """
+    return todos_from_rows(iter_unchecked_rows(data_dir, settings))
+
+def search_records(store, terms):
+    """
+    the TodoRecords of the unchecked todos containing all of terms, best
+    match first, bringing the text index up to date if needed.
+    """
+    from utils import unchecked_records
+    from textindex import TextIndex
+    with profiling.phase('text_index_update'):
+        fpaths = todolist_paths(settings=store.settings)
+        text_index = TextIndex(store, fpaths)
+        if not text_index.is_current():
+            with store.transaction():
+                text_index.update(record for fpath in fpaths \
+                        for record in unchecked_records(fpath, store.settings))
+    with profiling.phase('search'):
+        return text_index.search(terms)
+
+def refresh_snapshot(data_dir=DATA_DIR, settings=None):
+    """
+    rewrites the snapshot of the todolists that were changed here.
+    """
+    from utils import iter_todolist
+    with profiling.phase('write_snapshot'):
+        entries = read_snapshot(data_dir)
+        for fpath in todolist_paths(settings=settings):
+            if load_snapshot(fpath, data_dir, entries, settings) is None:
+                write_snapshot(iter_todolist(fpath, settings), fpath, data_dir, settings)
 
 class TodoFetcher(object):
-    def __init__(self, todolist):
+    def __init__(self, todolist, remote=False):
         self.todolist = todolist
+        # the check offs go through the server when it served the todolist
+        self.remote = remote
+        self.writer = None
 
     def wait_for_commitment(self):
         print('Ready to be productive? [Y/n]')
@@ -150,20 +206,59 @@ class TodoFetcher(object):
             print('Exiting.')
     
     def start(self):
-        for todo in self.todolist:
-            todo_str= todo['todo_item']
-            print(colored(todo_str, 'green'))
-            cd=CountDown(todo['times']['duration'])
-            exit_status = cd.start()
-            if exit_status['status'] == 'complete':
-                assert check_off_original_todo(todo['todo_item'])
-            if exit_status['status'] == 'out-of-time':
-                print('You ran out of time!') 
-            print(exit_status)
+        from utils import CheckOffWriter
+        from client import RemoteCheckOffWriter
+        import asyncio
+        # check offs are written to the todolist in batches during the
+        # session, at its end, and whenever the process exits
+        self.writer = RemoteCheckOffWriter() if self.remote else CheckOffWriter()
+        atexit.register(self.writer.flush)
+        try:
+            return asyncio.run(self.session())
+        finally:
+            self.flush()
+
+    async def session(self):
+        """
+        counts down every todo in turn, with the check offs written in the
+        background on the same event loop.
+        """
+        import asyncio
+        from countdown import CountDown, flush_periodically
+        flusher = asyncio.ensure_future(flush_periodically(self.flush))
+        try:
+            for todo in self.todolist:
+                print(colored(todo.text, 'green'))
+                cd=CountDown(todo.duration)
+                exit_status = await cd.run()
+                if exit_status['status'] == 'complete':
+                    self.writer.add(todo.text)
+                if exit_status['status'] == 'out-of-time':
+                    print('You ran out of time!') 
+                print(exit_status)
+        finally:
+            flusher.cancel()
         return todo 
 
+    def flush(self):
+        """
+        writes the pending check offs to the todolist, and refreshes the
+        snapshot to match.
+        """
+        if not len(self.writer):
+            return True
+        with profiling.phase('check_off_flush'):
+            flushed = self.writer.flush()
+        if not self.remote:
+            refresh_snapshot()
+        return flushed
+
 if __name__=="__main__":
     print ('starting todo fetch')
+    profile_format = profiling.enable_from_argv(sys.argv)
+    if profile_format is not None:
+        # registered first so that it runs last, after the check offs are written
+        atexit.register(profiling.report, profile_format)
     
     # read the time in from commandline
     if len(sys.argv) < 2:
@@ -173,77 +268,78 @@ if __name__=="__main__":
     
     option = sys.argv[1]
     
+    # served by server.py when it runs, unless profiling this process
+    served = profile_format is None
     if option == '-s' or option == '-k':
-        todo2date = unchecked_by_date()
         if option == '-s':
-            substring = ' '.join(sys.argv[2:])
             # looking for valid todo
-            target_todo2date = [element for element in todo2date if substring in element[0].lower()]
+            terms = [' '.join(sys.argv[2:])]
         else:
-            keywords = sys.argv[2:]
-            target_todo2date = [element for element in todo2date if all([kw in element[0].lower() for kw in keywords])]
+            terms = sys.argv[2:]
+        reply = served_request({'op': 'search', 'terms': terms}) if served else None
+        if reply is not None:
+            sys.stdout.write(reply['output'])
+            target_rows = reply['result']
+        else:
+            from store import IndexStore
+            store = IndexStore()
+            target_rows = snapshot_rows(search_records(store, terms))
+            store.close()
         
-        if len(target_todo2date) < 1:
+        if len(target_rows) < 1:
             if option == '-s':
                 raise ValueError('substring does not exist among unchecked items in the todolist')
             elif option == '-k':
                 raise ValueError('keyword(s) do not exist among unchecked items in the todolist')
         
-        # get the duration
-        todo2datedur = {element[0]:{'assign_date': element[1], 'duration':duration2datetime(find_duration(element[0]))} for element in target_todo2date}
-        todo2priority = {element[0]: 0 for element in target_todo2date}
-        todo2timedur = [{'times': {'duration': todo2datedur[element[0]]['duration']}} for i, element in enumerate(target_todo2date)]
-        total_dur = find_total_duration(todo2timedur)
+        # every match is picked, with the same priority
+        todos = todos_from_rows(target_rows)
+        total_minutes = sum([todo.minutes for todo in todos])
         
-        feasible_set = get_feasible_set(todo2datedur, todo2priority, total_dur) 
+        with profiling.phase('get_feasible_set'):
+            feasible_set = get_feasible_set(todos, total_minutes) 
         
         # these priorities are exponential to the date they are issued to the current date today.
          
         # display the todolist items, and start timing. Await for all items to be checked.
         # users have three options: either cancel, request more time, or check off current item.
         print(colored('@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@', 'cyan'))
-        for element in feasible_set:
-            print(colored(element['todo_item'], 'yellow'))
+        for todo in feasible_set:
+            print(colored(todo.text, 'yellow'))
         
-        TF = TodoFetcher(feasible_set) 
+        TF = TodoFetcher(feasible_set, reply is not None) 
         TF.wait_for_commitment()
 
     elif option == '-t':
         budget_time = sys.argv[2:]
-        budget_datetime = durationlist2datetime(budget_time)
-        
-        todo2date = unchecked_by_date()
-        expected_durations = []
-        for todo in todo2date:
-            duration = find_duration(todo[0])
-            if duration is None:
-                print('{} does not have an interpretable duration, will be replacing with default for this run.'.format(todo[0]))
-                todo_default_time= add_placeholder_duration(todo[0])                        
-                print('interpreted as: {}'.format(todo_default_time)) 
-                duration = find_duration(todo_default_time)
-            expected_durations.append(duration)
-
-        assert len(todo2date) == len(expected_durations)
-        expected_durations = [duration2datetime(dur) for dur in expected_durations]
+        mode = pop_option(budget_time, '--mode', 'knapsack')
+        if mode not in SCHEDULERS:
+            raise ValueError('--mode should be one of {}'.format(', '.join(SCHEDULERS)))
+        decay = pop_option(budget_time, '--decay', 'linear')
+        if decay not in DECAYS:
+            raise ValueError('--decay should be one of {}'.format(', '.join(DECAYS)))
+        budget_minutes = to_minutes(durationlist2datetime(budget_time))
         
-        todo2datedur = {}
-        for i in range(len(expected_durations)):
-            todo2datedur[todo2date[i][0]] = {'assign_date': todo2date[i][1],
-                                                'duration': expected_durations[i]}
-
-        # iterate through list of items, giving them different priorities.
-        todo2priority = get_priorities(todo2datedur)
-        feasible_set = get_feasible_set(todo2datedur, todo2priority, budget_datetime) 
+        reply = served_request({'op': 'schedule', 'budget_minutes': budget_minutes, 'mode': mode,
+            'decay': decay}) if served else None
+        if reply is not None:
+            sys.stdout.write(reply['output'])
+            feasible_set = [Todo(*row) for row in reply['result']]
+        else:
+            todos = load_todos()
+
+            # iterate through list of items, giving them different priorities.
+            feasible_set = schedule(todos, budget_minutes, mode, decay)
         
         # these priorities are exponential to the date they are issued to the current date today.
          
         # display the todolist items, and start timing. Await for all items to be checked.
         # users have three options: either cancel, request more time, or check off current item.
         print(colored('@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@', 'cyan'))
-        for element in feasible_set:
-            print(colored(element['todo_item'], 'yellow'))
+        for todo in feasible_set:
+            print(colored(todo.text, 'yellow'))
         
-        TF = TodoFetcher(feasible_set) 
+        TF = TodoFetcher(feasible_set, reply is not None) 
         TF.wait_for_commitment()
     else:
         raise ValueError('Invalid flag.')
@@ -2,72 +2,120 @@
 Script for syncing up notebook notes
 """
 import os
-import pickle
+import sys
+from functools import partial
 from datetime import datetime
 from utils import *
-import config 
+from scanner import find_modified_notes, scan_paths, file_digest, DirManifest, manifest_key
+from store import IndexStore
+from textindex import TextIndex
+from snapshot import read_snapshot, load_snapshot, write_snapshots
+from partitions import todolist_paths, split_by_todolist, ensure_todolist
+from shard import get_new_unchecked_todos_sharded, write_hashes_on_new_todos_sharded
+from settings import current, located
+import profiling
+import config
 
 
-if __name__ == '__main__':
+def sync(store, path2modtime, path2fingerprint, changed_paths=None, todolist_changed=True, jobs=1, settings=None):
+    """
+    Syncs the notes with the todolist: new todos in the notes are added to the
+    todolist, and todos checked off in the todolist are checked off in their
+    notes. path2modtime and path2fingerprint are updated in place.
 
-    if not os.path.exists('.data/'):
-        os.makedirs('.data/')
-    if os.path.exists('.data/mem.pkl'):
-        with open(os.path.join('.data/', 'mem.pkl'), 'rb')  as f:
-            params = pickle.load(f)
-        config.HEX_START = params['HEX_START']
-    else:
-        params = {} 
-    
-    if os.path.exists('.data/hash2completion.pkl'):
-        with open(os.path.join('.data/', 'hash2completion.pkl'), 'rb') as f:
-            hash2completion = pickle.load(f)
-    else:
-        hash2completion = {} 
+    If changed_paths is given, only those notes are looked at instead of
+    walking config.NOTES_DIRS, and the todolist is only read for check offs
+    if todolist_changed.
 
-    if os.path.exists('.data/hash2path.pkl'):
-        with open(os.path.join('.data/', 'hash2path.pkl'), 'rb') as f:
-            hash2path = pickle.load(f) # may need special script to regenerate if the paths of documents are changed
-    else:
-        hash2path = {}
-   
-    if os.path.exists('.data/path2modtime.pkl'):
-        with open(os.path.join('.data/', 'path2modtime.pkl'), 'rb') as f:
-            path2modtime = pickle.load(f)
-    else:
-        path2modtime = {}
-    
+    With partitioned todolists (see partitions.py), the new todos of a note
+    only go into the partition of its notes directory, and the check offs are
+    read from all of them.
+
+    With jobs > 1, the notes are parsed and tagged by a pool of that many
+    processes, with the same result as a sequential sync. The counters of
+    --profile then leave out the work done in the workers.
+
+    The settings are the ones of config, or settings (see settings.py).
+    """
+    conf = current(settings)
     # iterate through the whole list of notes
-    assert type(config.NOTES_DIRS) is list
-    assert type(config.VALID_EXT) is list
-    all_notes = []
-    for d in config.NOTES_DIRS: 
-        files = os.listdir(d)
-        files_path = [os.path.join(d, fname) for fname in \
-                files if ends_in_exts(fname, config.VALID_EXT)]
-        # check if it's got recent modifications
-        for filepath in files_path:
-            if has_new_modification(filepath, path2modtime):
-                all_notes.append(filepath)
-    
+    assert type(conf.NOTES_DIRS) is list
+    assert type(conf.VALID_EXT) is list
+    with profiling.phase('scan_notes'):
+        if changed_paths is None:
+            # recursively find the notes with recent modifications
+            # the directories unchanged since the last sync aren't listed
+            manifest = DirManifest(store.get_dir_manifest(manifest_key(settings)))
+            modified_notes, seen_notes = find_modified_notes(conf.NOTES_DIRS, path2modtime, path2fingerprint,
+                    manifest=manifest, settings=settings)
+            missing_notes = set(path2modtime) - seen_notes
+        else:
+            manifest = None
+            modified_notes, seen_notes = scan_paths(changed_paths, path2modtime, path2fingerprint, settings)
+            missing_notes = set(path for path in changed_paths if path in path2modtime) - seen_notes
+
+    # notes that are gone, and new notes with the exact same content, were moved
+    digest2missing = {path2fingerprint[path][1]: path for path in missing_notes if path in path2fingerprint}
+    moved_notes = {}
+    for note in modified_notes:
+        if note.path not in path2modtime and note.digest in digest2missing:
+            old_path = digest2missing.pop(note.digest)
+            moved_notes[old_path] = note.path
+            print('{} was moved to {}'.format(old_path, note.path))
+
+    # only the notes whose content changed need to be parsed
+    all_notes = [note.path for note in modified_notes if note.changed and note.path not in moved_notes.values()]
+
+    with profiling.phase('move_notes'), store.transaction():
+        for old_path in moved_notes:
+            store.move_note(old_path, moved_notes[old_path])
+        store.forget_notes([path for path in missing_notes if path not in moved_notes])
+        # notes that were moved and edited are matched by the hex tags in them
+        for note in all_notes:
+            if note not in path2modtime:
+                relinked = store.relink_todos(note, index_hex_offsets(note, settings).keys())
+                if relinked:
+                    print('{} todos were moved to {}'.format(relinked, note))
+    for path in missing_notes:
+        path2modtime.pop(path, None)
+        path2fingerprint.pop(path, None)
+    for note in modified_notes:
+        if note.path in moved_notes.values():
+            path2modtime[note.path] = note.modtime
+            path2fingerprint[note.path] = (note.size, note.digest)
+
     # iterate through all of the files, get back the checklist items
     note2newtodos_w_hashes = {}
-    for note in all_notes:
-        print('examining {}'.format(note))
-        todos_w_hashes = get_new_unchecked_todos(note) 
-        note2newtodos_w_hashes[note] = todos_w_hashes
-    
+    with profiling.phase('get_new_unchecked_todos'):
+        if jobs > 1 and len(all_notes) > 1:
+            note2newtodos_w_hashes = get_new_unchecked_todos_sharded(all_notes, jobs, settings)
+        else:
+            for note in all_notes:
+                print('examining {}'.format(note))
+                todos_w_hashes = get_new_unchecked_todos(note, settings)
+                note2newtodos_w_hashes[note] = todos_w_hashes
+
     # #########################################################################
     # loading the todo.md -> first thing to do --> cross off the items in the original notes
     # get the checked hashes
-    hashes = get_checked_hashes(config.TODOLIST_NAME)
+    with profiling.phase('parse_todolist'):
+        if todolist_changed:
+            fpath2records = {fpath: list(iter_todolist(fpath, settings)) \
+                    for fpath in todolist_paths(settings=settings)}
+            todolist_records = [record for records in fpath2records.values() for record in records]
+        else:
+            fpath2records = {}
+            todolist_records = None
+    # ignoring adhoc todolists without hashes
+    hashes = [record.hex for record in todolist_records or [] if record.checked and record.hex is not None]
     path2newcheckhash = {}
     newcheckhash = []
-    # find only the new hashes that have recently been checked off 
-    for hash_ in hashes: 
-        if hash2completion['0x'+hash_] is False: # hash not currently checked of
+    # find only the new hashes that have recently been checked off
+    hex2path = store.get_uncompleted_paths(['0x'+hash_ for hash_ in hashes])
+    for hash_ in hashes:
+        if '0x'+hash_ in hex2path: # hash not currently checked of
             newcheckhash.append(hash_)
-            filepath = hash2path['0x'+hash_]
+            filepath = hex2path['0x'+hash_]
             if filepath not in path2newcheckhash:
                 path2newcheckhash[filepath] = [hash_]
             else:
@@ -75,45 +123,161 @@ if __name__ == '__main__':
     # for each file, find the hashes and check them off
     mark_as_newly_completed = []
     newly_completed_fpaths = []
-    for fpath in path2newcheckhash:
-        assert type(path2newcheckhash[fpath]) is list
-        if check_off_original_notes(fpath, path2newcheckhash[fpath]):
+    patched_fpaths = []
+    with profiling.phase('check_off_original_notes'):
+        for fpath in path2newcheckhash:
+            assert type(path2newcheckhash[fpath]) is list
+            # patch the boxes in place when the note's offset index is still valid,
+            # otherwise scan and rewrite the note
+            hex2offset = store.get_hex_offsets(fpath)
+            if hex2offset is not None and patch_checkboxes(fpath, path2newcheckhash[fpath], hex2offset, settings):
+                patched_fpaths.append(fpath)
+            elif not check_off_original_notes(fpath, path2newcheckhash[fpath], settings):
+                continue
             mark_as_newly_completed.extend(path2newcheckhash[fpath]) # we will only update hash2complete if the file can be found
             newly_completed_fpaths.append(fpath)
+    # the hex tags of the new todos go at the byte offsets found when parsing,
+    # which moved in the notes rewritten line by line to check them off
+    for fpath in newly_completed_fpaths:
+        if fpath not in patched_fpaths and len(note2newtodos_w_hashes.get(fpath, [])):
+            note2newtodos_w_hashes[fpath] = relocate_new_todos(fpath, note2newtodos_w_hashes[fpath], settings)
     if len(mark_as_newly_completed) != len(newcheckhash):
         print('There are some notes that cannot be discovered. either find and \
-                reposition them in the correct paths or remake the path database')
-    
-    # ######################################################################### 
+                reposition them in the correct paths or remake the path database \
+                with python todolist.py --rebuild')
+
+    # #########################################################################
     # writing to todo.md
     # adding new todo's into the todo file
-    write_to_todo(note2newtodos_w_hashes) 
-    write_hashes_on_new_todos(note2newtodos_w_hashes)
-    # ######################################################################### 
-    
-    # before exiting:
-    # 1. update hash2completion for hex values in mark_as_newly_completed, and add new hex values from recent hashes
-    for hash_ in mark_as_newly_completed:
-        hash2completion['0x'+hash_] = True
-    # 2. update hash2path with the new todo items in note2newtodos_w_hashes 
-    for note in note2newtodos_w_hashes:
-        for tup in note2newtodos_w_hashes[note]:
-            hash2path[tup[1]] = note 
-            hash2completion[tup[1]] = False
-    
-    for filepath in list(set(all_notes + newly_completed_fpaths)):
-        path2modtime[filepath] = get_modification_date(filepath)
-
-    with open(os.path.join('.data/', 'hash2completion.pkl'), 'wb') as f:
-        print('updated hash2completion')
-        pickle.dump(hash2completion,f)
-    with open(os.path.join('.data/', 'hash2path.pkl'), 'wb') as f:
-        print('updated hash2path')
-        pickle.dump(hash2path, f)
-    # 3. update HEX_START in mem.pkl
-    with open(os.path.join('.data/', 'mem.pkl'), 'wb') as f:
-        pickle.dump({'HEX_START': config.HEX_START}, f)
-    # 4. update modification times
-    with open(os.path.join('.data/', 'path2modtime.pkl'), 'wb') as f:
-        pickle.dump(path2modtime, f)
+    text_index_current = TextIndex(store, todolist_paths(settings=settings)).is_current()
+    fpath2header_offsets = {}
+    if sum([len(todos) for todos in note2newtodos_w_hashes.values()]):
+        # the hex ids handed out are reserved before any of them is written,
+        # so that a sync that dies half way never hands them out again
+        with profiling.phase('reserve_hex_ids'), store.transaction():
+            store.set_hex_start(conf.HEX_START)
+        with profiling.phase('write_to_todo'):
+            # only the todolists getting new todos are rewritten
+            for fpath, notes in split_by_todolist(note2newtodos_w_hashes, settings).items():
+                ensure_todolist(fpath, settings)
+                fpath2header_offsets[fpath] = write_to_todo(notes, store.get_header_offsets(fpath), fpath, settings)
+        with profiling.phase('write_hashes_on_new_todos'):
+            if jobs > 1 and len(all_notes) > 1:
+                write_hashes_on_new_todos_sharded(note2newtodos_w_hashes, jobs, settings)
+            else:
+                write_hashes_on_new_todos(note2newtodos_w_hashes, settings)
+    # #########################################################################
+
+    # records for the todos just added, to update the text index with
+    today = parse_mmddyy(get_date_string())
+    new_records = []
+    for line in todoline_formatter(note2newtodos_w_hashes):
+        todo = line.strip()
+        new_records.append(TodoRecord(todo, False, today, find_hex(todo, settings)['hex'],
+                parse_duration(todo), None, None))
+
+    # before exiting, update the index in a single transaction:
+    path2newmodtime = {}
+    path2newfingerprint = {}
+    for note in modified_notes:
+        if not note.changed:
+            # only the modification date moved
+            path2newmodtime[note.path] = note.modtime
+            path2newfingerprint[note.path] = (note.size, note.digest)
+    with profiling.phase('fingerprint_notes'):
+        for filepath in list(set(all_notes + newly_completed_fpaths)):
+            path2newmodtime[filepath] = get_modification_date(filepath, settings)
+            path2newfingerprint[filepath] = (os.path.getsize(located(filepath, settings)),
+                    file_digest(located(filepath, settings)))
+            profiling.count('bytes_read', path2newfingerprint[filepath][0])
+
+    with profiling.phase('store_commit'), store.transaction():
+        # 1. update completion for hex values in mark_as_newly_completed
+        store.mark_completed(['0x'+hash_ for hash_ in mark_as_newly_completed])
+        # 2. add the new todo items in note2newtodos_w_hashes, with their paths
+        store.add_todos({tup[1]: note for note in note2newtodos_w_hashes \
+                for tup in note2newtodos_w_hashes[note]})
+        # 3. update HEX_START
+        store.set_hex_start(conf.HEX_START)
+        # 4. update modification times
+        store.set_modtimes(path2newmodtime)
+        store.set_fingerprints(path2newfingerprint)
+        # 5. update the hex offset index of the notes that were touched
+        for filepath in list(set(all_notes + newly_completed_fpaths)):
+            if filepath in patched_fpaths and filepath not in all_notes:
+                store.set_note_signature(filepath, note_signature(filepath, settings))
+            else:
+                store.set_hex_offsets(filepath, note_signature(filepath, settings),
+                        index_hex_offsets(filepath, settings))
+        for note in modified_notes:
+            if not note.changed and note.path not in newly_completed_fpaths:
+                store.set_note_signature(note.path, note_signature(note.path, settings))
+        for fpath in fpath2header_offsets:
+            store.set_header_offsets(fpath, fpath2header_offsets[fpath])
+        if manifest is not None:
+            store.save_dir_manifest(manifest, manifest_key(settings))
+        # 6. update the text index for the -s and -k lookups
+        text_index = TextIndex(store, todolist_paths(settings=settings))
+        if todolist_records is not None:
+            text_index.update(todolist_records + new_records)
+        elif text_index_current and len(new_records):
+            text_index.update(new_records, partial=True)
+    # the snapshot of the unchecked todos that todofetcher.py starts from
+    with profiling.phase('write_snapshot'):
+        entries = read_snapshot(store.data_dir)
+        fpath2snapshot = {}
+        for fpath in todolist_paths(settings=settings):
+            if fpath in fpath2header_offsets:
+                fpath2snapshot[fpath] = iter_todolist(fpath, settings)
+            elif fpath in fpath2records:
+                fpath2snapshot[fpath] = fpath2records[fpath]
+            elif load_snapshot(fpath, store.data_dir, entries, settings) is None:
+                fpath2snapshot[fpath] = iter_todolist(fpath, settings)
+        if len(fpath2snapshot):
+            write_snapshots(fpath2snapshot, store.data_dir, settings)
+    path2modtime.update(path2newmodtime)
+    path2fingerprint.update(path2newfingerprint)
+    print('updated index')
+
 
+if __name__ == '__main__':
+
+    profile_format = profiling.enable_from_argv(sys.argv)
+    if len(sys.argv) == 1 and profile_format is None:
+        # a plain sync is done by server.py when it runs, with its state in
+        # memory, unless profiling this process
+        from client import request
+        reply = request({'op': 'sync'})
+        if reply is not None:
+            sys.stdout.write(reply['output'])
+            sys.exit(0)
+    with profiling.phase('store_load'):
+        store = IndexStore()
+        config.HEX_START = store.get_hex_start()
+        path2modtime = store.get_modtimes()
+        path2fingerprint = store.get_fingerprints()
+
+    jobs = None
+    if '--jobs' in sys.argv[1:]:
+        jobs = int(sys.argv[sys.argv.index('--jobs') + 1])
+
+    if '--rebuild' in sys.argv[1:]:
+        # before syncing, so that the check offs find the notes their todos are in now
+        from rebuild import rebuild
+        rebuild(store, jobs)
+    jobs = 1 if jobs is None else jobs
+
+    if '--watch' in sys.argv[1:]:
+        from watch import watch
+        watch(partial(sync, jobs=jobs), store, path2modtime, path2fingerprint)
+    else:
+        sync(store, path2modtime, path2fingerprint, jobs=jobs)
+        if '--compact' in sys.argv[1:]:
+            # synced first, so that the todos checked off in the todolist are
+            # checked off in their notes before their sections are archived
+            from compact import compact
+            for fpath in todolist_paths():
+                compact(store, fpath)
+    store.close()
+    if profile_format is not None:
+        profiling.report(profile_format)
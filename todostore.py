@@ -0,0 +1,200 @@
+"""
+TodoStore, to use the notes and todolists of a directory from Python instead
+of through the command line scripts:
+
+    from todostore import TodoStore
+
+    with TodoStore('~/notes', PARTITION_TODOLISTS=True) as todos:
+        todos.sync()
+        for record in todos.unchecked_by_date():
+            print(record.date, record.text)
+        todos.check_off(todos.schedule('1 h 30 m'))
+
+It shares the index store, the snapshot and the todolists with todolist.py,
+todofetcher.py and server.py, so they can be used on the same directory.
+
+Everything runs in the calling process. A TodoStore keeps its settings in a
+Settings of its own (see settings.py), which it passes to the syncs, check
+offs and schedules, so it never changes config or the working directory.
+"""
+import os
+import threading
+import contextlib
+from datetime import datetime, timedelta
+from collections import namedtuple
+from store import IndexStore, DATA_DIR
+from scheduler import SCHEDULERS, DECAYS, to_minutes, duration2datetime
+from settings import Settings, located
+from partitions import todolist_paths
+from utils import TodoRecord, CheckOffWriter, NOTE_PATTERN, hex_key
+from todofetcher import iter_unchecked_rows, load_todos, search_records, refresh_snapshot
+from todofetcher import schedule as schedule_todos
+from todolist import sync as sync_notes
+
+HexInfo = namedtuple('HexInfo', ['hex', 'path', 'completed', 'archive'])
+
+def row_record(row):
+    """
+    the TodoRecord of a (text, hex, date ordinal, minutes) row of the
+    snapshot. Its line_nb and offset are None.
+    """
+    text, hex_id, ordinal, minutes = row
+    return TodoRecord(text, False, None if ordinal is None else datetime.fromordinal(ordinal),
+            hex_id, None if minutes is None else timedelta(minutes=minutes), None, None)
+
+def todo_text(todo):
+    """
+    the text of a todo given as a string, a Todo or a TodoRecord.
+    """
+    return todo if isinstance(todo, str) else todo.text
+
+class TodoStore(object):
+    """
+    The notes and todolists under root (the working directory by default),
+    with settings that override the ones of config.py (e.g.
+    TODOLIST_NAME='todo.md', NOTES_DIRS=['travis/']). What the syncs,
+    schedules and check offs print goes to stdout, like with the scripts. A
+    TodoStore can be used from several threads; its syncs, searches, lookups
+    and check offs are done one at a time.
+    """
+    def __init__(self, root=None, data_dir=DATA_DIR, **overrides):
+        assert 'HEX_START' not in overrides, 'HEX_START is kept by the index store'
+        self.settings = Settings(os.getcwd() if root is None else root, **overrides)
+        self.root = self.settings.root
+        self.data_dir = os.path.join(self.root, data_dir)
+        self.lock = threading.RLock()
+        # the sync state, loaded by the first sync
+        self.path2modtime = None
+        self.path2fingerprint = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        forgets the sync state, which the next sync loads again.
+        """
+        with self.lock:
+            self.path2modtime = None
+            self.path2fingerprint = None
+
+    @contextlib.contextmanager
+    def index_store(self):
+        """
+        the index store, held by one request at a time. A sqlite connection
+        can't be shared between threads, so every request opens its own.
+        """
+        with self.lock:
+            store = IndexStore(self.data_dir, self.settings)
+            try:
+                yield store
+            finally:
+                store.close()
+
+    def todolists(self):
+        """
+        the absolute paths of the todolists, in the order they are read.
+        """
+        return [located(fpath, self.settings) for fpath in todolist_paths(settings=self.settings)]
+
+    def unchecked(self):
+        """
+        yields the TodoRecords of the unchecked todos, todolist by todolist
+        in the order of their lines. They come from the snapshot, and a
+        todolist that changed since it was written is only parsed when it is
+        reached.
+        """
+        for row in iter_unchecked_rows(self.data_dir, self.settings):
+            yield row_record(row)
+
+    def unchecked_by_date(self, newest_first=False):
+        """
+        yields the TodoRecords of the unchecked todos by the date they were
+        assigned, the oldest first. All of them are read before the first one
+        is yielded.
+        """
+        records = sorted(self.unchecked(), key=lambda record: record.date or datetime.min,
+                reverse=newest_first)
+        for record in records:
+            yield record
+
+    def by_note(self, path):
+        """
+        yields the TodoRecords of the unchecked todos that came from the note
+        at path (relative to the root, like in the todolists).
+        """
+        path = os.path.normpath(path)
+        for record in self.unchecked():
+            note = NOTE_PATTERN.search(record.text)
+            if note is not None and os.path.normpath(note.group(1)) == path:
+                yield record
+
+    def search(self, *terms):
+        """
+        yields the TodoRecords of the unchecked todos containing all of
+        terms, best match first.
+        """
+        with self.index_store() as store:
+            records = search_records(store, list(terms))
+        for record in records:
+            yield record
+
+    def lookup(self, hex_id):
+        """
+        the HexInfo of the todo with hex_id (an int, '0x...' or a todo with a
+        tag): the note it is in, whether it is completed and the archive it
+        was moved to if any. None if the hex id is unknown.
+        """
+        hex_id = hex_key(hex_id, self.settings)
+        with self.index_store() as store:
+            completed = store.get_completion(hex_id)
+            if completed is None:
+                return None
+            return HexInfo(hex_id, store.get_path(hex_id), completed, store.get_archive(hex_id))
+
+    def schedule(self, budget, mode='knapsack', decay='linear'):
+        """
+        the list of Todos to work on within budget, in minutes or as a
+        duration string ('1 h 30 m'), like todofetcher.py -t.
+        """
+        if mode not in SCHEDULERS:
+            raise ValueError('mode should be one of {}'.format(', '.join(SCHEDULERS)))
+        if decay not in DECAYS:
+            raise ValueError('decay should be one of {}'.format(', '.join(DECAYS)))
+        budget_minutes = to_minutes(duration2datetime(budget)) if isinstance(budget, str) else budget
+        return schedule_todos(load_todos(self.data_dir, self.settings), budget_minutes, mode, decay,
+                self.settings)
+
+    def check_off(self, todos):
+        """
+        checks off todos (strings, Todos or TodoRecords) in the todolists,
+        all in one pass. Their notes are checked off by the next sync. Returns
+        false if some of them weren't found.
+        """
+        writer = CheckOffWriter(settings=self.settings)
+        for todo in todos:
+            writer.add(todo_text(todo))
+        if not len(writer):
+            return True
+        with self.lock:
+            flushed = writer.flush()
+            refresh_snapshot(self.data_dir, self.settings)
+        return flushed
+
+    def sync(self, changed_paths=None, jobs=1):
+        """
+        syncs the notes with the todolists like todolist.py, or only the
+        notes at changed_paths (relative to the root). The sync state is kept
+        in memory between syncs.
+        """
+        with self.index_store() as store:
+            if self.path2modtime is None:
+                self.path2modtime = store.get_modtimes()
+                self.path2fingerprint = store.get_fingerprints()
+            # the scripts may have handed out hex ids since the last sync
+            self.settings.HEX_START = store.get_hex_start()
+            sync_notes(store, self.path2modtime, self.path2fingerprint, changed_paths, jobs=jobs,
+                    settings=self.settings)
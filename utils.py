@@ -2,9 +2,26 @@
 utilities functions 
 """
 import os
-import pickle
+import re
+import mmap
+from collections import namedtuple
 from datetime import datetime, timedelta
-import config
+from scheduler import durationlist2datetime, duration2datetime
+from partitions import todolist_paths, todolist_for_note
+from settings import current, located
+import profiling
+
+# a checklist item of the todolist, along with the date section it is under.
+# duration is a timedelta (None if missing), line_nb and offset locate the
+# start of the line, in lines and in bytes.
+TodoRecord = namedtuple('TodoRecord', ['text', 'checked', 'date', 'hex', 'duration', 'line_nb', 'offset'])
+
+# files are scanned in chunks of this size when they can't be mapped as a whole
+SCAN_CHUNK = 1 << 20
+
+DATE_PATTERN = re.compile(r'\s*(\d{1,2})\s*/\s*(\d{1,2})\s*/\s*(\d\d)\s*$')
+# the note a todo of the todolist came from, as written by todoline_formatter
+NOTE_PATTERN = re.compile(r'\(in `([^`]*)`\)\s*$')
 
 def ends_in_ext(fname, ext):
     """
@@ -22,27 +39,120 @@ def ends_in_exts(fname, exts):
             return True
     return False
 
-def has_checklist_marker(line, checked):
+def trie_pattern(words):
+    """
+    builds a regular expression matching any of words, nested as a trie so
+    that matching at a position costs the length of the longest word instead
+    of the number of words. Longer words are preferred.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[''] = {}
+
+    def build(node):
+        branches = [re.escape(ch) + build(node[ch]) for ch in sorted(node) if ch != '']
+        if not len(branches):
+            return ''
+        pattern = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        if '' in node:
+            return '(?:' + pattern + ')?'
+        return pattern
+    return build(trie)
+
+marker_matcher_cache = {}
+# at most this many matchers are kept, one over str and one over bytes for
+# each set of markers
+MARKER_MATCHERS = 16
+
+def marker_key(settings=None):
+    conf = current(settings)
+    return (tuple(conf.CHECKLIST_CHECKED_MARKERS), tuple(conf.CHECKLIST_UNCHECKED_MARKERS))
+
+def get_marker_matcher(settings=None):
+    """
+    returns a compiled pattern matching all of the checked and unchecked
+    markers in config, and a dictionary of marker -> (checked, index of the
+    marker in its config list). Only rebuilt when the markers in config change.
+    """
+    conf = current(settings)
+    key = marker_key(settings)
+    if key not in marker_matcher_cache:
+        assert type(conf.CHECKLIST_UNCHECKED_MARKERS) is list
+        assert type(conf.CHECKLIST_CHECKED_MARKERS) is list
+        assert len(conf.CHECKLIST_UNCHECKED_MARKERS) == len(conf.CHECKLIST_CHECKED_MARKERS)
+        marker2kind = {}
+        for mk_idx, marker in enumerate(conf.CHECKLIST_UNCHECKED_MARKERS):
+            marker2kind.setdefault(marker, (False, mk_idx))
+        for mk_idx, marker in enumerate(conf.CHECKLIST_CHECKED_MARKERS):
+            marker2kind.setdefault(marker, (True, mk_idx))
+        if len(marker_matcher_cache) >= MARKER_MATCHERS:
+            marker_matcher_cache.clear()
+        marker_matcher_cache[key] = (re.compile(trie_pattern(marker2kind)), marker2kind)
+        # the same matcher over bytes, to search memory mapped files with
+        marker_matcher_cache[key + ('bytes',)] = (re.compile(trie_pattern(marker2kind).encode('utf-8')),
+                {marker.encode('utf-8'): marker2kind[marker] for marker in marker2kind})
+    return marker_matcher_cache[key]
+
+def get_bytes_marker_matcher(settings=None):
+    """
+    returns the same as get_marker_matcher, for searching bytes.
+    """
+    get_marker_matcher(settings)
+    return marker_matcher_cache[marker_key(settings) + ('bytes',)]
+
+def find_marker(line, settings=None):
+    """
+    finds the first checklist marker in a line, and returns its index, whether
+    it is checked, and the index of the marker in its config list. Returns
+    (None, None, None) if the line isn't a checklist item.
+    """
+    pattern, marker2kind = get_marker_matcher(settings)
+    match = pattern.search(line)
+    if match is None:
+        return None, None, None
+    checked, mk_idx = marker2kind[match.group(0)]
+    return match.start(), checked, mk_idx
+
+def has_checklist_marker(line, checked, settings=None):
     """
     checks if a line (string) has a checked or unchecked marker (depending on 
     whether `checked`==True), and returns the index of the marker, as well as 
     the index of the type of marker found.
     """
-    assert type(line) is str
-    # returns the index where the marker is found and the index corresponding 
-    # to the marker type
-    assert type(config.CHECKLIST_UNCHECKED_MARKERS) is list
-    assert type(config.CHECKLIST_CHECKED_MARKERS) is list
-    if checked:
-        markers_list = config.CHECKLIST_CHECKED_MARKERS
-    else:
-        markers_list = config.CHECKLIST_UNCHECKED_MARKERS
-    for mk_idx, marker in enumerate(markers_list):
-        idx = line.find(marker)
-        if idx != -1:
-            return idx, mk_idx 
+    pattern, marker2kind = get_marker_matcher(settings)
+    for match in pattern.finditer(line):
+        if marker2kind[match.group(0)][0] == checked:
+            return match.start(), marker2kind[match.group(0)][1]
     return None, None
 
+def classify_line(line, settings=None):
+    """
+    classifies a line as a checked or unchecked checklist item with a single
+    search, and returns the index of its marker along with whether it is
+    checked. Returns (None, None) if the line isn't a checklist item.
+    """
+    idx, checked, _ = find_marker(line, settings)
+    return idx, checked
+
+def parse_mmddyy(line):
+    """
+    returns the datetime of a line holding a mm/dd/yy date, or None if the line
+    is not a date. Equivalent to mmddyy2datetime, without raising.
+    """
+    match = DATE_PATTERN.match(line)
+    if match is None:
+        return None
+    month, day, year = [int(group) for group in match.groups()]
+    # same pivot as strptime's %y
+    year += 2000 if year < 69 else 1900
+    try:
+        return datetime(year, month, day)
+    except ValueError:
+        return None
+
 def mmddyy2datetime(mmddyy):
     """
     mmddyy string to datetime object.
@@ -52,58 +162,101 @@ def mmddyy2datetime(mmddyy):
     return datetime_mmddyy
 
 
-def durationlist2datetime(duration_split):
+def iter_todolist(fpath=None, settings=None):
     """
-    duration string split (by spaces) list to datetime object.
+    Reads a todolist file (config.TODOLIST_NAME by default) in a single pass,
+    yielding a TodoRecord for every checked and unchecked item.
     """
-    assert len(duration_split)%2 == 0
-    digits = []
-    if len(duration_split) == 4:
-        # case # h # m
-        digits = [int(duration_split[0]), int(duration_split[2])] 
-    elif len(duration_split) == 2:
-        if duration_split[1] == 'm':
-            digits = [0, int(duration_split[0])]
-        elif duration_split[1] == 'h':
-            digits = [int(duration_split[0]), 0]
-        else:
-            raise ValueError('duration string should be in the form # m, # h, or # h # m')
-    assert len(digits) != 0
-    duration_datetime = timedelta(hours = digits[0], minutes=digits[1])# datetime.strptime('::'.join(digits),'%H::%M')
-    return duration_datetime 
+    if fpath is None:
+        fpath = current(settings).TODOLIST_NAME
+    current_date = None
+    offset = 0
+    with open(located(fpath, settings), 'rb') as f:
+        for l_nb, raw_line in enumerate(f):
+            line = raw_line.decode('utf-8')
+            idx, checked = classify_line(line, settings)
+            if idx is not None:
+                todo = line[idx:].strip()
+                found = find_hex(todo, settings)
+                yield TodoRecord(todo, checked, current_date,
+                        None if found is None else found['hex'],
+                        parse_duration(todo), l_nb, offset)
+            else:
+                date = parse_mmddyy(line)
+                if date is not None:
+                    current_date = date
+            offset += len(raw_line)
+    profiling.count('files_parsed')
+    profiling.count('bytes_read', offset)
+    profiling.count('lines_scanned', l_nb + 1 if offset else 0)
+
+def unchecked_records(fpath=None, settings=None):
+    """
+    yields the TodoRecords of the unchecked items in the todolist
+    """
+    for record in iter_todolist(fpath, settings):
+        if not record.checked:
+            assert record.date is not None, "we have a rogue todolist item without a date"
+            yield record
 
-def duration2datetime(duration_str):
-    """
-    Duration string to datetime object.
-    """ 
-    duration_split = duration_str.split()
-    return durationlist2datetime(duration_split) 
-    
 def unchecked_by_date():
     """
     Returns a list of tuples of the form (todo_string, datetime_assigned)
     """
-    with open(config.TODOLIST_NAME, 'r') as f:
-        lines = f.readlines()
-        dates_lnb = find_all_datetimes_mmddyy_in_lines(lines) 
-    
-    todos, todo_nb = get_todos(config.TODOLIST_NAME, checked=False)
-    todos_lnb = list(zip(todos, todo_nb))
-    # open up the todolist file 
-    master_list = dates_lnb + todos_lnb
-    master_list = sorted(master_list, key = lambda x: x[1])
-    
-    # [(todo item, date)]
-    current_date = None
-    todo2date = []
-    for element in master_list:
-        if type(element[0]) is datetime:
-            current_date = element[0] 
-        elif type(element[0]) is str:
-            assert current_date is not None, "we have a rogue todolist item without a date"
-            todo2date.append((element[0], current_date))
-    return todo2date
+    return [(record.text, record.date) for record in unchecked_records()]
+
 
+def map_file(f, writable=False):
+    """
+    memory maps an open file, returning None for an empty file (which can't be
+    mapped).
+    """
+    if os.fstat(f.fileno()).st_size == 0:
+        return None
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+
+def count_newlines(mm, start, end):
+    """
+    counts the newlines in mm[start:end], copying at most SCAN_CHUNK bytes at a
+    time.
+    """
+    count = 0
+    for chunk_start in range(start, end, SCAN_CHUNK):
+        count += mm[chunk_start:min(chunk_start + SCAN_CHUNK, end)].count(b'\n')
+    return count
+
+def iter_checklist_items(fpath, settings=None):
+    """
+    Scans a file for checklist items by searching for the marker bytes in a
+    memory map of it, decoding only the lines that have a marker. Yields a
+    tuple of (todo, checked, line number, byte offset of the marker, byte
+    offset of the end of the line's content) for every item.
+    """
+    pattern, marker2kind = get_bytes_marker_matcher(settings)
+    with open(located(fpath, settings), 'rb') as f:
+        mm = map_file(f)
+        profiling.count('files_parsed')
+        if mm is None:
+            return
+        profiling.count('bytes_read', len(mm))
+        with mm:
+            l_nb = 0
+            counted_to = 0
+            line_end = 0
+            for match in pattern.finditer(mm):
+                pos = match.start()
+                if pos < line_end:
+                    continue # another marker on the same line
+                line_start = mm.rfind(b'\n', counted_to, pos) + 1 or counted_to
+                l_nb += count_newlines(mm, counted_to, line_start)
+                counted_to = line_start
+                line_end = mm.find(b'\n', pos)
+                if line_end == -1:
+                    line_end = len(mm)
+                raw_todo = mm[pos:line_end]
+                profiling.count('lines_decoded')
+                yield (raw_todo.decode('utf-8').strip(), marker2kind[match.group(0)][0], l_nb,
+                        pos, pos + len(raw_todo.rstrip()))
 
 def get_todos(fpath, checked):
     """
@@ -114,17 +267,14 @@ def get_todos(fpath, checked):
     assert os.path.exists(fpath)
     todos = []
     todo_nb = []
-    with open(fpath, 'r') as f:
-        lines=f.readlines()
-        for l_nb, line in enumerate(lines):
-            idx, mk_idx = has_checklist_marker(line, checked)
-            if idx is not None and mk_idx is not None:
-                todos.append( line[idx:].strip() )
-                todo_nb.append(l_nb)
+    for todo, todo_checked, l_nb, _, _ in iter_checklist_items(fpath):
+        if todo_checked == checked:
+            todos.append(todo)
+            todo_nb.append(l_nb)
 
     return todos, todo_nb
 
-def find_hex(todo):
+def find_hex(todo, settings=None):
     """
     given a single todo item as a string, find the hex_string and its index in the
     string. If none found, return None.
@@ -133,7 +283,7 @@ def find_hex(todo):
     hex_idx = todo.find('{0x')
     if hex_idx == -1:
         return None
-    hex_str = todo[hex_idx+len('{0x') : hex_idx+len('{0x')+config.HEX_BITS]
+    hex_str = todo[hex_idx+len('{0x') : hex_idx+len('{0x')+current(settings).HEX_BITS]
     try:
         int(hex_str, 16)
     except ValueError: 
@@ -141,30 +291,51 @@ def find_hex(todo):
     
     return {'where': hex_idx, 'hex': hex_str} 
 
-def generate_hex():
+def format_hex(value, settings=None):
+    """
+    the hex id ('0x...') of an integer.
+    """
+    return '0x'+'%0{}X'.format(current(settings).HEX_BITS) % value
+
+def hex_key(value, settings=None):
+    """
+    the hex id as the index store keeps it ('0x...'), given an int, a bare or
+    '0x' hex string, or a todo with a {0x...} tag in it.
+    """
+    if isinstance(value, int):
+        return format_hex(value, settings)
+    if '{0x' not in value:
+        value = '{0x' + (value[2:] if value.lower().startswith('0x') else value)
+    found = find_hex(value, settings)
+    if found is None:
+        raise ValueError('no hex id in {}'.format(value))
+    return format_hex(int(found['hex'], 16), settings)
+
+def generate_hex(settings=None):
     """
     increments the global hex id, and returns it.
     """
     # global config.HEX_START
-    new_hex = '0x'+'%0{}X'.format(config.HEX_BITS) % config.HEX_START
-    config.HEX_START += 1
+    conf = current(settings)
+    new_hex = format_hex(conf.HEX_START, settings)
+    conf.HEX_START += 1
     return new_hex
 
-def assign_hex(todo, new_hex):
+def assign_hex(todo, new_hex, settings=None):
     """
     Generates/replaces the todo hex, and appends it to the end of the string,
     then returns that todo.
     """
     # assuming that the todo doesn't already have a hex assigned to it.
     # if it does, then overwite it
-    old_hex = find_hex(todo)
+    old_hex = find_hex(todo, settings)
     assert type(todo) is str and type(new_hex) is str
     if old_hex == None:
         if todo[-1] != ' ':
             todo += ' '
         todo += '{' + new_hex + ')'
     else:
-        todo[old_hex['where'] + len('{') : old_hex['where'] + len('{')+config.HEX_BITS] = new_hex
+        todo[old_hex['where'] + len('{') : old_hex['where'] + len('{')+current(settings).HEX_BITS] = new_hex
     
     return todo
 
@@ -211,6 +382,19 @@ def find_duration(todo):
     
     return duration
 
+def parse_duration(todo):
+    """
+    Returns the duration of a single todo as a timedelta, or None if it has no
+    interpretable duration. Unlike find_duration, nothing is printed.
+    """
+    last_comma_idx = todo.rfind(',')
+    if last_comma_idx == -1:
+        return None
+    duration = read_duration(todo[last_comma_idx:])
+    if duration is None:
+        return None
+    return duration2datetime(duration)
+
 def add_placeholder_duration(todo):
     """
     Attaching default duration to the end of the todo list item, and returning it.
@@ -232,23 +416,23 @@ def add_placeholder_duration(todo):
     #     todo = todo[: -(last_comma_idx + 1)] + ' 30 m' + todo[-(last_comma_idx + 1):] 
     # return todo 
 
-def get_new_unchecked_todos(fpath):
+def parse_new_unchecked_todos(fpath, settings=None):
     """
-    From a file (fpath), return list of tuples for todos, their hashes, 
-    and their line numbers in the original text files (though those are subject 
-    to change)
+    From a file (fpath), return list of tuples for the todos that don't have a
+    hash yet, their line numbers in the original text files (though those are
+    subject to change), and the byte offsets where their hashes go. Doesn't
+    touch the global hex id, so notes can be parsed in any order.
     """
-    todos, todo_lnb = get_todos(fpath, False)
-    
     # check there isn't a hash already given. if so, drop it
     new_todos = []
     new_todo_lnb = []
-    for idx, todo in enumerate(todos):
-        if find_hex(todo) is None: # means that it's new
+    new_todo_ends = []
+    for todo, checked, l_nb, _, content_end in iter_checklist_items(fpath, settings):
+        if not checked and find_hex(todo, settings) is None: # means that it's new
             new_todos.append(todo)
-            new_todo_lnb.append(todo_lnb[idx])
+            new_todo_lnb.append(l_nb)
+            new_todo_ends.append(content_end)
 
-    new_hashes = [generate_hex() for todo in new_todos]
     # for each todo, we should check that there's a time duration indicated
     new_todos_wtime = []
     for todo in new_todos:
@@ -259,21 +443,35 @@ def get_new_unchecked_todos(fpath):
             new_todos_wtime.append(todo)
         else:
             new_todos_wtime.append(todo)    
-    assert len(new_hashes) == len(new_todos_wtime)
-    return list(zip(new_todos_wtime, new_hashes, new_todo_lnb))
+    return list(zip(new_todos_wtime, new_todo_lnb, new_todo_ends))
+
+def get_new_unchecked_todos(fpath, settings=None):
+    """
+    From a file (fpath), return list of tuples for todos, their hashes, 
+    their line numbers in the original text files (though those are subject 
+    to change), and the byte offsets where their hashes go.
+    """
+    return [(todo, generate_hex(settings), l_nb, end) for todo, l_nb, end in parse_new_unchecked_todos(fpath, settings)]
+
+def relocate_new_todos(fpath, todos_w_hashes, settings=None):
+    """
+    the (todo, hex, line number, end offset) tuples of the new todos of the
+    note at fpath with their end offsets read again by line number, for after
+    the note was rewritten in a way that moved its bytes but kept its lines
+    (see check_off_original_notes).
+    """
+    l_nb2end = {l_nb: end for _, checked, l_nb, _, end in iter_checklist_items(fpath, settings) if not checked}
+    for todo, hex_id, l_nb, _ in todos_w_hashes:
+        assert l_nb in l_nb2end, "new todo on line {} of {} went missing".format(l_nb, fpath)
+    return [(todo, hex_id, l_nb, l_nb2end[l_nb]) for todo, hex_id, l_nb, _ in todos_w_hashes]
 
 def get_checked_hashes(fpath):
     """
     for all checked todos, return the set of all hex hashes
     """
-    todos, _ = get_todos(fpath, True)
-    checked_hashes = []
-    for todo in todos:
-        checked_hex = find_hex(todo)
-        if checked_hex is not None: # ignoring adhoc todolists without hashes
-            hex_string = checked_hex['hex']
-            checked_hashes.append(hex_string)
-    return checked_hashes
+    # ignoring adhoc todolists without hashes
+    return [record.hex for record in iter_todolist(fpath) \
+            if record.checked and record.hex is not None]
 
 
 def find_line_with_hash(lines, hex_id):
@@ -286,73 +484,283 @@ def find_line_with_hash(lines, hex_id):
 
     return None
 
-def check_off_line(line):
+def check_off_line(line, settings=None):
     """
     Return a version of the line where the box is checked off.
     """
-    for idx, element in enumerate(config.CHECKLIST_UNCHECKED_MARKERS):
-        checkbox_idx = line.find(element)
-        if checkbox_idx != -1:
-            return line [:checkbox_idx] + config.CHECKLIST_CHECKED_MARKERS[idx] \
-                    + line[checkbox_idx + len(config.CHECKLIST_UNCHECKED_MARKERS[idx]) : ]
-    
-    for idx, element in enumerate(config.CHECKLIST_CHECKED_MARKERS):
-        checkbox_idx = line.find(element)
-        if checkbox_idx != -1:
-            return line # this line was already checked
+    conf = current(settings)
+    idx, mk_idx = has_checklist_marker(line, False, settings)
+    if idx is not None:
+        return line[:idx] + conf.CHECKLIST_CHECKED_MARKERS[mk_idx] \
+                + line[idx + len(conf.CHECKLIST_UNCHECKED_MARKERS[mk_idx]) : ]
+    if find_marker(line, settings)[0] is not None:
+        return line # this line was already checked
     
     return None
 
+def new_file_mode():
+    """
+    the mode of a file created with open(): 0666 less the umask.
+    """
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+def atomic_write_chunks(fpath, chunks):
+    """
+    writes chunks of bytes to a temporary file next to fpath and then moves it
+    over fpath, so that readers (e.g. an editor reloading the file) never see a
+    partially written file.
+    """
+    import tempfile
+    tmp_fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(fpath)),
+            prefix='.'+os.path.basename(fpath)+'.')
+    written = 0
+    try:
+        with os.fdopen(tmp_fd, 'wb') as f:
+            for chunk in chunks:
+                written += f.write(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.exists(fpath):
+            os.chmod(tmp_path, os.stat(fpath).st_mode)
+        else:
+            # the mode open() would have created it with, instead of mkstemp's 0600
+            os.chmod(tmp_path, new_file_mode())
+        os.replace(tmp_path, fpath)
+    except:
+        os.remove(tmp_path)
+        raise
+    profiling.count('bytes_written', written)
+    profiling.count('full_file_rewrites')
+
+def atomic_write_lines(fpath, lines):
+    """
+    same as atomic_write_chunks, for lines of text.
+    """
+    atomic_write_chunks(fpath, (line.encode('utf-8') for line in lines))
+
+def copy_with_inserts(f, inserts):
+    """
+    yields the content of the open binary file f in chunks of at most
+    SCAN_CHUNK bytes, with the (offset, bytes) of inserts spliced in.
+    """
+    pos = 0
+    for offset, data in sorted(inserts) + [(None, b'')]:
+        while offset is None or pos < offset:
+            chunk = f.read(SCAN_CHUNK if offset is None else min(SCAN_CHUNK, offset - pos))
+            if not chunk:
+                break
+            pos += len(chunk)
+            yield chunk
+        yield data
+
+class CheckOffWriter(object):
+    """
+    Collects the todos checked off during a session, and applies all of them
+    to the todolist in a single pass when flushed. With partitioned todolists
+    (and no fpath), only the partitions holding the todos are rewritten.
+    """
+    def __init__(self, fpath=None, settings=None):
+        self.fpath = fpath
+        self.settings = settings
+        self.pending_hex = set()
+        # todos without a hex id fall back to a substring match
+        self.pending_strings = []
+        # the todolists the pending todos were added to, from their notes
+        self.pending_todolists = []
+
+    def __len__(self):
+        return len(self.pending_hex) + len(self.pending_strings)
+
+    def add(self, todo_string):
+        found = find_hex(todo_string, self.settings)
+        if found is None:
+            self.pending_strings.append(todo_string)
+        else:
+            self.pending_hex.add(found['hex'])
+        note = NOTE_PATTERN.search(todo_string)
+        if note is not None:
+            fpath = todolist_for_note(note.group(1), self.settings)
+            if fpath not in self.pending_todolists:
+                self.pending_todolists.append(fpath)
+
+    def todolists(self):
+        """
+        the todolists to look for the pending todos in, the likely ones first.
+        """
+        if self.fpath is not None:
+            return [self.fpath]
+        fpaths = todolist_paths(settings=self.settings)
+        return [fpath for fpath in self.pending_todolists if fpath in fpaths] \
+                + [fpath for fpath in fpaths if fpath not in self.pending_todolists]
+
+    def matches(self, line):
+        found = find_hex(line, self.settings) if self.pending_hex else None
+        if found is not None and found['hex'] in self.pending_hex:
+            return True
+        return any(todo_string in line for todo_string in self.pending_strings)
+
+    def check_off_lines(self, lines):
+        """
+        yields the lines with the boxes of the pending todos checked off, and
+        removes the todos found from the pending ones.
+        """
+        for line in lines:
+            found = find_hex(line, self.settings) if self.pending_hex else None
+            if found is not None and found['hex'] in self.pending_hex:
+                self.pending_hex.remove(found['hex'])
+                line = check_off_line(line, self.settings)
+            else:
+                for idx, todo_string in enumerate(self.pending_strings):
+                    if todo_string in line:
+                        del self.pending_strings[idx]
+                        line = check_off_line(line, self.settings)
+                        break
+            yield line
+
+    def flush(self):
+        """
+        writes the pending check offs to the todolist. Return true upon
+        success, false otherwise.
+        """
+        if not len(self):
+            return True
+        fpaths = self.todolists()
+        for fpath in fpaths:
+            if not len(self):
+                break
+            try:
+                with open(located(fpath, self.settings), 'r', encoding='utf-8', newline='') as f:
+                    # partitions without any of the todos are left alone
+                    if len(fpaths) > 1 and not any(self.matches(line) for line in f):
+                        continue
+                    f.seek(0)
+                    atomic_write_lines(located(fpath, self.settings), self.check_off_lines(f))
+            except FileNotFoundError:
+                print('Failed to read todolist at location {}'.format(fpath))
+                return False
+        self.pending_todolists = []
+        if len(self):
+            for todo in sorted(self.pending_hex) + self.pending_strings:
+                print('todo item [ {} ] not found in todolist'.format(todo))
+            self.pending_hex = set()
+            self.pending_strings = []
+            return False
+        return True
+
 def check_off_original_todo(todo_string):
     """
     given a todo_string, check it off in the original todo list. 
     """
+    writer = CheckOffWriter()
+    writer.add(todo_string)
+    return writer.flush()
+
+def note_signature(fpath, settings=None):
+    """
+    returns the (size, mtime_ns) of a file, which tells whether an index built
+    for it is still valid.
+    """
+    st = os.stat(located(fpath, settings))
+    return (st.st_size, st.st_mtime_ns)
+
+def index_hex_offsets(fpath, settings=None):
+    """
+    for every checklist item in fpath that is tagged with a hex id, returns a
+    dictionary of hex id ('0x...') -> byte offset of its checklist marker. Only
+    the lines with a tag are decoded.
+    """
+    pattern, _ = get_bytes_marker_matcher(settings)
+    hex2offset = {}
+    with open(located(fpath, settings), 'rb') as f:
+        mm = map_file(f)
+        if mm is None:
+            return hex2offset
+        profiling.count('bytes_read', len(mm))
+        with mm:
+            tag = mm.find(b'{0x')
+            while tag != -1:
+                line_start = mm.rfind(b'\n', 0, tag) + 1
+                line_end = mm.find(b'\n', tag)
+                if line_end == -1:
+                    line_end = len(mm)
+                match = pattern.search(mm, line_start, line_end)
+                found = find_hex(mm[tag:line_end].decode('utf-8', 'replace'), settings)
+                if match is not None and found is not None:
+                    hex2offset['0x'+found['hex']] = match.start()
+                tag = mm.find(b'{0x', line_end)
+    return hex2offset
+
+def patch_checkboxes(fpath, hex_ids, hex2offset, settings=None):
+    """
+    within a single note file, check off the boxes of hex_ids in place, by
+    overwriting the unchecked marker at the offset found in hex2offset with the
+    checked marker of the same length. Nothing is written if any offset doesn't
+    point at the marker of its todo; returns true upon success, false otherwise.
+    """
+    conf = current(settings)
+    patches = []
     try:
-        with open(config.TODOLIST_NAME, 'r') as f:
-            lines = f.readlines()
-            found = False
-            for idx, line in enumerate(lines):
-                if todo_string in line:
-                    lines[idx]=check_off_line(line)
-                    found = True
-                    break
-            if not found:
-                raise ValueError ('todo item [ {} ] not found in todolist'.format(todo_string))
-    except FileNotFoundError:
-        print('Failed to read todolist at location {}'.format(config.TODOLIST_NAME))
-        return False
-    try:
-        with open(config.TODOLIST_NAME, 'w') as f:
-            f.writelines(lines)
-            return True
+        with open(located(fpath, settings), 'r+b') as f:
+            for hex_id in hex_ids:
+                if '0x'+hex_id not in hex2offset:
+                    return False
+                f.seek(hex2offset['0x'+hex_id])
+                rest_of_line = f.readline().decode('utf-8', 'replace')
+                if '{0x'+hex_id not in rest_of_line:
+                    return False
+                idx, checked, mk_idx = find_marker(rest_of_line, settings)
+                if idx != 0:
+                    return False
+                if checked:
+                    continue # this line was already checked
+                checked_marker = conf.CHECKLIST_CHECKED_MARKERS[mk_idx].encode('utf-8')
+                if len(checked_marker) != len(conf.CHECKLIST_UNCHECKED_MARKERS[mk_idx].encode('utf-8')):
+                    return False
+                patches.append((hex2offset['0x'+hex_id], checked_marker))
+            for offset, checked_marker in patches:
+                f.seek(offset)
+                f.write(checked_marker)
+                profiling.count('bytes_written', len(checked_marker))
+            profiling.count('in_place_patches', len(patches))
     except FileNotFoundError:
-        print('Failed to write to todolist at location {}'.format(config.TODOLIST_NAME))
         return False
+    return True
 
-def check_off_original_notes(fpath, hex_ids):
+def check_off_original_notes(fpath, hex_ids, settings=None):
     """
     within a single note file, check off ever box corresponding to a list of 
     hex_ids. Return true upon success, false otherwise.
     """
     assert type(hex_ids) is list
+    # the boxes are overwritten in place when the markers are the same length
+    try:
+        if patch_checkboxes(fpath, hex_ids, index_hex_offsets(fpath, settings), settings):
+            return True
+    except FileNotFoundError:
+        print('{} not found'. format(fpath))
+        return False
     # opens up the file, and then checks off the box
     try: 
-        with open(fpath, 'r') as f:
+        with open(located(fpath, settings), 'r') as f:
             lines = f.readlines()
             # find the line with the hex
             for hex_id in hex_ids:
                 line_tup = find_line_with_hash(lines, hex_id)
-                assert line_tup is not None, "database needs to be updated"
+                assert line_tup is not None, "database needs to be updated, run python todolist.py --rebuild"
                 line_id = line_tup[0]
-                line = check_off_line(line_tup[1])
+                line = check_off_line(line_tup[1], settings)
                 lines[line_id] = line
     except FileNotFoundError:
         print('{} not found'. format(fpath))
         return False
 
     try:
-        with open(fpath, 'w') as f:
+        with open(located(fpath, settings), 'w') as f:
             f.writelines(lines) 
+        profiling.count('full_file_rewrites')
+        profiling.count('bytes_written', sum(len(line.encode('utf-8')) for line in lines) if profiling.ENABLED else 0)
         return True
     except:
         return False
@@ -377,11 +785,9 @@ def find_datestring_in_lines(lines, ds):
 def find_all_datetimes_mmddyy_in_lines(lines): 
     datetimes_lnb =[]
     for line_idx, line in enumerate(lines):
-        try:
-            datetime_mmddyy = mmddyy2datetime(line)
+        datetime_mmddyy = parse_mmddyy(line)
+        if datetime_mmddyy is not None:
             datetimes_lnb.append((datetime_mmddyy, line_idx))
-        except ValueError:
-            continue
     return datetimes_lnb
 
 def find_todoheader_in_lines(lines):
@@ -403,31 +809,90 @@ def todoline_formatter(note2newtodos_w_hashes):
     
     return write_todos 
  
-def write_to_todo(note2newtodos_w_hashes):
-    """
-    writing to the todolist for a list of new todolist items.
+def line_key(raw_line):
+    """
+    a line of bytes without any whitespace, as the headers are compared.
+    """
+    return ''.join(raw_line.decode('utf-8', 'replace').split())
+
+def find_header_offsets(f, ds, cached=None):
+    """
+    returns a dictionary of header -> byte offset of the start of its first
+    line in the open binary file f, for the '#TODO' header and the date
+    string ds. The cached offsets are checked by reading the line at them,
+    and the file is only scanned, one line at a time, when they are stale.
+    Without a cached offset for ds (on the first write of the day), the
+    newest date header is the first line after '#TODO' that isn't blank, so
+    only that line is read.
+    """
+    offsets = {}
+    for key in cached or {}:
+        if key == ds or key == '#TODO':
+            f.seek(max(cached[key] - 1, 0))
+            if cached[key] == 0 or f.read(1) == b'\n':
+                if line_key(f.readline()) == key:
+                    offsets[key] = cached[key]
+    if ds in offsets:
+        return offsets
+    if '#TODO' in offsets and ds not in (cached or {}):
+        f.seek(offsets['#TODO'])
+        offset = offsets['#TODO'] + len(f.readline())
+        for raw_line in f:
+            key = line_key(raw_line)
+            if key:
+                if key == ds:
+                    offsets[ds] = offset
+                break
+            offset += len(raw_line)
+        return offsets
+    # stale or missing: today's header can be anywhere, so look for it everywhere
+    profiling.count('todo_header_scans')
+    f.seek(0)
+    offset = 0
+    for raw_line in f:
+        key = line_key(raw_line)
+        if (key == ds or key == '#TODO') and key not in offsets:
+            offsets[key] = offset
+            if key == ds:
+                break
+        offset += len(raw_line)
+    profiling.count('bytes_read', offset)
+    return offsets
+
+def write_to_todo(note2newtodos_w_hashes, header_offsets=None, fpath=None, settings=None):
+    """
+    writing to the todolist (config.TODOLIST_NAME by default) for a list of
+    new todolist items, under today's date header. The todolist is streamed
+    to a temporary file with the new lines spliced in, so memory use doesn't
+    grow with its size. header_offsets are the ones returned by the previous
+    call, and the header offsets after the write are returned.
     """
     assert type(note2newtodos_w_hashes) is dict
+    fpath = current(settings).TODOLIST_NAME if fpath is None else fpath
     ds =get_date_string()
-    # loading current todo
-    with open(config.TODOLIST_NAME, 'r') as f:
-        lines = f.readlines()
-        d_nb = find_datestring_in_lines(lines, ds)
-    
     # formatting new todos
     newlines = todoline_formatter(note2newtodos_w_hashes)
-    if d_nb is None:
-        t_nb = find_todoheader_in_lines(lines)
-        newlines = [ds+'\n'] + newlines + ['\n']
-        new_todolist = lines[:t_nb+1] + newlines + lines[t_nb+1:]
-    else:
-        new_todolist = lines[:d_nb+1] + newlines + lines[d_nb+1:] 
-     
-    # writing current todo 
-    with open(config.TODOLIST_NAME, 'w') as f:
-        f.writelines(new_todolist)
-
-def write_hashes_on_new_todos(note2newtodos_w_hashes):
+    with open(located(fpath, settings), 'rb') as f:
+        offsets = find_header_offsets(f, ds, header_offsets)
+        if ds in offsets:
+            header = ds
+        else:
+            assert '#TODO' in offsets, 'no #TODO header in {}'.format(fpath)
+            header = '#TODO'
+            newlines = [ds+'\n'] + newlines + ['\n']
+        f.seek(offsets[header])
+        header_line = f.readline()
+        insert_at = offsets[header] + len(header_line)
+        # a header on the last line may not end with a newline yet
+        prefix = b'' if header_line.endswith(b'\n') else b'\n'
+        data = prefix + ''.join(newlines).encode('utf-8')
+        if header == '#TODO':
+            offsets[ds] = insert_at + len(prefix)
+        f.seek(0)
+        atomic_write_chunks(located(fpath, settings), copy_with_inserts(f, [(insert_at, data)]))
+    return offsets
+
+def write_hashes_on_new_todos(note2newtodos_w_hashes, settings=None):
     """
     for every single note containing a new todo item, insert the hex id at the
     end of the line containing the new todo.
@@ -435,20 +900,17 @@ def write_hashes_on_new_todos(note2newtodos_w_hashes):
     for note in note2newtodos_w_hashes:
         if len(note2newtodos_w_hashes[note]): # open the file only if you have new todo's from here
             todo_hashes = note2newtodos_w_hashes[note]
-            # todo_hashes is a list of 3-tuples, where the 3rd element is the line number where the todolist item is
-            with open(note, 'r') as f:
-                lines = f.readlines()
-                for tup in todo_hashes:
-                    # appending hex
-                    lines[tup[2]] = lines[tup[2]].strip() + ' {%s}\n'%tup[1] 
-            with open(note, 'w') as f:
-                f.writelines(lines)
+            # todo_hashes is a list of 4-tuples, where the 4th element is the
+            # offset of the end of the line where the todolist item is
+            inserts = [(tup[3], (' {%s}'%tup[1]).encode('utf-8')) for tup in todo_hashes]
+            with open(located(note, settings), 'rb') as f:
+                atomic_write_chunks(located(note, settings), copy_with_inserts(f, inserts))
 
-def get_modification_date(filepath):
+def get_modification_date(filepath, settings=None):
     """
     returning the modification date of a file as a datetime object
     """
-    t = os.path.getmtime(filepath)
+    t = os.path.getmtime(located(filepath, settings))
     return datetime.fromtimestamp(t)
 
 def has_new_modification(filepath, path2modtime):
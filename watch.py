@@ -0,0 +1,176 @@
+"""
+Watch mode for todolist.py: stays resident, and syncs the notes that changed
+as soon as they are saved.
+"""
+import os
+import sys
+import time
+import select
+import struct
+import ctypes
+import ctypes.util
+from scanner import wanted_subdir, wanted_path
+from partitions import partitioned, todolist_paths, todolists_signature
+import config
+
+# seconds without new events before a burst of saves is synced
+DEBOUNCE = 0.3
+# seconds between scans when inotify isn't available
+POLL_INTERVAL = 5
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+EVENT_HEADER = struct.Struct('iIII')
+
+class InotifyWatcher(object):
+    """
+    Watches every directory under dirs, and the directories holding the
+    todolists, with Linux inotify.
+    """
+    def __init__(self, dirs, todolists):
+        libc_name = ctypes.util.find_library('c')
+        if libc_name is None:
+            raise OSError('libc not found')
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self.libc, 'inotify_init1'):
+            raise OSError('inotify is not available')
+        self.libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = self.libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.wd2dir = {}
+        self.todolists = set(todolists)
+        for d in dirs:
+            self.add_tree(d)
+        for d in set(os.path.dirname(todolist) or '.' for todolist in todolists):
+            self.add_dir(d)
+
+    def add_dir(self, d):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(d), WATCH_MASK)
+        if wd < 0:
+            print('WARNING: cannot watch {}'.format(d))
+            return
+        self.wd2dir[wd] = d
+
+    def add_tree(self, d):
+        """
+        watches d and all of its subdirectories, and returns the notes in them.
+        """
+        notes = set()
+        for root, subdirs, files in os.walk(d):
+            # the directories and notes that a sync of everything skips aren't watched
+            subdirs[:] = [subdir for subdir in subdirs if wanted_subdir(os.path.join(root, subdir))]
+            self.add_dir(root)
+            notes.update(path for path in (os.path.join(root, fname) for fname in files) if wanted_path(path))
+        return notes
+
+    def wait(self, timeout):
+        """
+        waits up to timeout seconds (forever if None) for events, and returns
+        the set of paths that changed. Returns None when events were lost, and
+        everything has to be rescanned.
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+        data = os.read(self.fd, 1 << 16)
+        changed = set()
+        pos = 0
+        while pos < len(data):
+            wd, mask, _, name_len = EVENT_HEADER.unpack_from(data, pos)
+            name = data[pos + EVENT_HEADER.size : pos + EVENT_HEADER.size + name_len].rstrip(b'\0')
+            pos += EVENT_HEADER.size + name_len
+            if mask & IN_Q_OVERFLOW:
+                return None
+            if mask & IN_IGNORED:
+                self.wd2dir.pop(wd, None)
+                continue
+            if wd not in self.wd2dir or not name:
+                continue
+            path = os.path.join(self.wd2dir[wd], os.fsdecode(name))
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO) and wanted_subdir(path):
+                    changed |= self.add_tree(path)
+                elif mask & IN_MOVED_FROM:
+                    # the notes that were in there are gone from here
+                    return None
+            elif path in self.todolists or wanted_path(path):
+                changed.add(path)
+        return changed
+
+class PollingWatcher(object):
+    """
+    Fallback for systems without inotify: reports that everything has to be
+    rescanned every interval seconds.
+    """
+    def __init__(self, interval=POLL_INTERVAL):
+        self.interval = interval
+
+    def wait(self, timeout):
+        time.sleep(self.interval if timeout is None else min(timeout, self.interval))
+        return None
+
+def make_watcher(dirs, todolists):
+    try:
+        return InotifyWatcher(dirs, todolists)
+    except (OSError, AttributeError) as e:
+        print('WARNING: inotify unavailable ({}), polling every {} s instead'.format(e, POLL_INTERVAL))
+        return PollingWatcher()
+
+def wait_for_changes(watcher, debounce=DEBOUNCE):
+    """
+    blocks until something changes, then keeps collecting events until none
+    arrive for debounce seconds. Returns the set of changed paths, or None to
+    rescan everything.
+    """
+    changed = watcher.wait(None)
+    while changed is not None:
+        more = watcher.wait(debounce)
+        if more is None:
+            return None
+        if not len(more):
+            break
+        changed |= more
+    return changed
+
+def watch(sync, store, path2modtime, path2fingerprint, debounce=DEBOUNCE):
+    """
+    syncs everything once with the sync function of todolist.py, then syncs
+    only the notes that change for as long as it runs. The sync state stays in
+    memory between syncs.
+    """
+    # as the watcher reports them
+    todolists = [os.path.join('.', fpath) if not os.path.dirname(fpath) else fpath \
+            for fpath in todolist_paths(existing=False)]
+    if partitioned() and not os.path.exists(config.PARTITION_DIR):
+        os.makedirs(config.PARTITION_DIR)
+    watcher = make_watcher(config.NOTES_DIRS, todolists)
+    sync(store, path2modtime, path2fingerprint)
+    last_signature = todolists_signature(todolist_paths())
+    print('watching for changes, Ctrl-C to stop')
+    try:
+        while True:
+            changed = wait_for_changes(watcher, debounce)
+            # our own writes to the todolists show up as events too
+            signature = todolists_signature(todolist_paths())
+            todolist_changed = signature != last_signature
+            if changed is None:
+                sync(store, path2modtime, path2fingerprint, None, todolist_changed)
+            else:
+                notes = set(os.path.normpath(path) for path in changed if path not in todolists)
+                if not len(notes) and not todolist_changed:
+                    continue
+                sync(store, path2modtime, path2fingerprint, notes, todolist_changed)
+            last_signature = todolists_signature(todolist_paths())
+            sys.stdout.flush()
+    except KeyboardInterrupt:
+        print('stopped watching')